@@ -0,0 +1,56 @@
+"""
+Compares the per-volume contour extraction time of DataLoader with and without the png round-trip.
+
+Usage: python -m benchmarks.bench_contour_extraction
+"""
+import tempfile
+import time
+
+import numpy as np
+
+from bld.data import DataDownloader, DataLoader
+from benchmarks.synthetic import write_dataset
+
+
+def time_extraction(data_loader: DataLoader, file_path: str, in_memory: bool, repeat: int) -> float:
+    """
+    Returns the best time of the contour extraction of one volume.
+    """
+    data_loader.in_memory = in_memory
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data_loader.get_contour_from_image(file_path=file_path)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def main():
+    shapes = [(100, 256, 256), (300, 256, 256), (300, 512, 512)]
+
+    for shape in shapes:
+        with tempfile.TemporaryDirectory() as root_folder:
+            write_dataset(folder=root_folder + "/data", number_of_patients=1, shape=shape)
+            ddl = DataDownloader(ref_url="", test_url="", data_folder="data", root_folder=root_folder)
+            dl = DataLoader(patient=1, data_downloader=ddl)
+            file_path = dl.labels_ref[0]
+
+            png = time_extraction(data_loader=dl, file_path=file_path, in_memory=False, repeat=3)
+            memory = time_extraction(data_loader=dl, file_path=file_path, in_memory=True, repeat=3)
+
+            dl.in_memory = False
+            contours_png = dl.get_contour_from_image(file_path=file_path)
+            dl.in_memory = True
+            contours_memory = dl.get_contour_from_image(file_path=file_path)
+            identical = all(
+                len(contours_png[key]) == len(contours_memory[key]) and
+                all(np.array_equal(a, b) for a, b in zip(contours_png[key], contours_memory[key]))
+                for key in contours_png)
+
+        print("volume %s: png round-trip %.3f s, in-memory %.3f s, speed-up %.1fx, identical contours: %s"
+              % (shape, png, memory, png / memory, identical))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Compares the Hausdorff methods of TraditionalMetricsCalculator (cdist, k-d tree, distance transform)
+on slices with one or several contours of different sizes.
+
+Usage: python -m benchmarks.bench_hausdorff
+"""
+import time
+
+import numpy as np
+
+from bld.data.dataloader import extract_contours
+from bld.evaluation import TraditionalMetricsCalculator
+from benchmarks.synthetic import ellipse_volume
+
+
+def lesion_slice(size: int, number_of_lesions: int, rng: np.random.Generator, scale: float) -> np.ndarray:
+    """
+    Creates a mask slice with several elliptic lesions along the diagonal.
+    """
+    mask = np.zeros((1, size, size), dtype=np.uint8)
+    step = size / (number_of_lesions + 1)
+    for k in range(number_of_lesions):
+        center = (0, step * (k + 1) + rng.uniform(-1, 1), step * (k + 1) + rng.uniform(-1, 1))
+        radii = (1, step * 0.35 * scale * rng.uniform(0.9, 1.1), step * 0.3 * scale * rng.uniform(0.9, 1.1))
+        mask |= ellipse_volume(shape=(1, size, size), center=center, radii=radii)
+
+    return mask[0]
+
+
+def best_time(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    for size, number_of_lesions in [(256, 1), (512, 1), (1024, 1), (2048, 1), (512, 8), (1024, 24)]:
+        mask_ref = lesion_slice(size=size, number_of_lesions=number_of_lesions, rng=rng, scale=1.0)
+        mask_test = lesion_slice(size=size, number_of_lesions=number_of_lesions, rng=rng, scale=0.95)
+        points_ref = extract_contours(image_slice=mask_ref)
+        points_test = extract_contours(image_slice=mask_test)
+        number_of_points = sum(c.size // 2 for c in points_ref)
+
+        calculator = TraditionalMetricsCalculator(points_test=points_test, points_ref=points_ref,
+                                                  slice_mask_ref=mask_ref, slice_mask_test=mask_test)
+        times, values = dict(), dict()
+        for method in TraditionalMetricsCalculator.hausdorff_methods:
+            calculator.hausdorff_method = method
+            times[method] = best_time(calculator.find_max_hausdorff, repeat=3)
+            values[method] = (calculator.find_max_hausdorff(), calculator.hausdorff_95,
+                              calculator.average_surface_distance)
+
+        print("%4dx%-4d %2d contours %5d points: cdist %.1f ms, kdtree %.1f ms, edt %.1f ms, "
+              "HD %.2f HD95 %.2f ASD %.3f, identical: %s"
+              % (size, size, len(points_ref), number_of_points,
+                 times["cdist"] * 1e3, times["kdtree"] * 1e3, times["edt"] * 1e3,
+                 *values["cdist"], values["cdist"] == values["kdtree"] == values["edt"]))
+
+
+if __name__ == '__main__':
+    main()
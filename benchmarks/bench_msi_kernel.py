@@ -0,0 +1,62 @@
+"""
+Measures the per-contour overhead of the MSI calculation from the final BLD values:
+the former pandas implementation, MSICalculator.calculate_msi and MSICalculator.calculate_msi_batch.
+
+Usage: python -m benchmarks.bench_msi_kernel
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from bld.metrics import MSICalculator
+
+
+def pandas_msi(final_bld: np.ndarray, il: float, ol: float) -> float:
+    """
+    The former implementation of MSICalculator.calculate_msi with one DataFrame for each side.
+    """
+    mcf_inside = pd.DataFrame(data=final_bld, columns=['corr.BLD'])
+    mcf_outside = pd.DataFrame(data=final_bld, columns=['corr.BLD'])
+    mcf_inside['WF value'] = MSICalculator.weight_function(
+        d=mcf_inside.loc[mcf_inside['corr.BLD'] < 0], l=il)
+    mcf_outside['WF value'] = MSICalculator.weight_function(
+        d=mcf_outside.loc[mcf_outside['corr.BLD'] > 0], l=ol)
+
+    return 1 / len(final_bld) * (mcf_inside['WF value'].sum() + mcf_outside['WF value'].sum())
+
+
+def main():
+    rng = np.random.default_rng(0)
+    il, ol = 1, 2
+    msi_calc = MSICalculator(il=il, ol=ol, test_points=[], ref_points=[])
+
+    for number_of_points in [50, 200, 1000]:
+        number_of_contours = 1000
+        # signed BLD values, about a tenth of the points is on the reference contour
+        final_blds = [np.round(rng.normal(0, 3, number_of_points), 1) for _ in range(number_of_contours)]
+
+        start = time.perf_counter()
+        reference = [pandas_msi(final_bld=b, il=il, ol=ol) for b in final_blds]
+        pandas_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        single = [msi_calc.calculate_msi(final_bld=b) for b in final_blds]
+        single_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = MSICalculator.calculate_msi_batch(final_blds=final_blds, il=il, ol=ol)
+        batch_time = time.perf_counter() - start
+
+        print("%4d points/contour: pandas %.1f us, calculate_msi %.1f us, calculate_msi_batch %.1f us per contour, "
+              "max. deviation from pandas %.1e, batch equals single: %s"
+              % (number_of_points,
+                 pandas_time / number_of_contours * 1e6,
+                 single_time / number_of_contours * 1e6,
+                 batch_time / number_of_contours * 1e6,
+                 np.max(np.abs(np.subtract(reference, single))),
+                 np.array_equal(single, batch)))
+
+
+if __name__ == '__main__':
+    main()
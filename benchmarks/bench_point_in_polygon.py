@@ -0,0 +1,68 @@
+"""
+Compares the per-point cv.pointPolygonTest loop with the batched points_polygon_test
+on contour sizes of prostate segmentations.
+
+Usage: python -m benchmarks.bench_point_in_polygon
+"""
+import time
+
+import cv2 as cv
+import numpy as np
+
+from bld.metrics.bld_calculator import points_polygon_test
+
+
+def ellipse_contour(number_of_points: int, center: tuple, radii: tuple, phase: float) -> np.ndarray:
+    """
+    Creates the integer contour points of a wavy ellipse (one point in each row).
+    """
+    theta = np.linspace(0, 2 * np.pi, number_of_points, endpoint=False)
+    radius_modulation = 1 + 0.05 * np.sin(5 * theta + phase)
+    x = center[0] + radii[0] * radius_modulation * np.cos(theta)
+    y = center[1] + radii[1] * radius_modulation * np.sin(theta)
+
+    return np.round(np.stack([x, y], axis=1)).astype(np.int32)
+
+
+def opencv_loop(points: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """
+    The point by point classification with OpenCV.
+    """
+    poly = polygon.astype(np.float32)
+    location = []
+    for point in points:
+        location.append(cv.pointPolygonTest(poly, (np.float32(point[0]), np.float32(point[1])), False))
+
+    return np.array(location)
+
+
+def best_time(func, repeat: int, **kwargs) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(**kwargs)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def main():
+    # the contour of a prostate on a 256x256 slice has some hundred points,
+    # upsampled or high resolution masks have a few thousand
+    for number_of_points in [100, 250, 500, 1000, 2000, 4000]:
+        scale = number_of_points / 250
+        reference = ellipse_contour(number_of_points, center=(128 * scale, 128 * scale),
+                                    radii=(40 * scale, 30 * scale), phase=0)
+        test = ellipse_contour(number_of_points, center=(128 * scale, 128 * scale),
+                               radii=(41 * scale, 29 * scale), phase=1).astype(np.float64) + 0.5
+
+        identical = np.array_equal(opencv_loop(reference, test), points_polygon_test(reference, test))
+        loop = best_time(opencv_loop, repeat=3, points=reference, polygon=test)
+        batched = best_time(points_polygon_test, repeat=3, points=reference, polygon=test)
+
+        print("%5d points: cv.pointPolygonTest loop %.2f ms, batched %.2f ms, speed-up %.1fx, identical: %s"
+              % (number_of_points, loop * 1e3, batched * 1e3, loop / batched, identical))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Compares the MSI of resampled contours (ContourResampler) with the full resolution MSI:
+the speed-up of MSICalculator.run and the deviation of the MSI values for several target spacings
+and point limits, on synthetic slices of increasing resolution.
+
+The test slices are slightly different shapes (variant), and partially coincident shapes: the reference
+with a small bump (bump) or moved by one pixel (shift). The coincident contour points have zero BLD,
+the deviation of these pairs shows whether the resampling keeps them.
+
+Usage: python -m benchmarks.bench_resampling
+"""
+import time
+
+import numpy as np
+
+from bld.data.dataloader import extract_contours
+from bld.metrics import ContourResampler, MSICalculator
+from benchmarks.synthetic import perturbed_mask, shape_mask
+
+settings = [
+    ("spacing 1.5", ContourResampler(spacing=1.5)),
+    ("spacing 2", ContourResampler(spacing=2)),
+    ("spacing 3", ContourResampler(spacing=3)),
+    ("spacing 4", ContourResampler(spacing=4)),
+    ("max 512 points", ContourResampler(max_points=512)),
+    ("max 256 points", ContourResampler(max_points=256)),
+    ("max 128 points", ContourResampler(max_points=128)),
+]
+groups = ["variant", "bump", "shift"]
+
+
+def best_time(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def run_msi(points_ref: list, points_test: list, il: float, ol: float, resampler=None) -> list:
+    msi_calc = MSICalculator(il=il, ol=ol, ref_points=points_ref, test_points=points_test, resampler=resampler)
+    msi_calc.run()
+
+    return msi_calc.msi
+
+
+def get_cases(size: int) -> dict:
+    """
+    The (reference contours, test contours) pairs of each group of test slices.
+    """
+    cases = {group: [] for group in groups}
+    for kind in ["circle", "ellipse", "concave", "multi"]:
+        mask_ref = shape_mask(kind=kind, size=size)
+        masks_test = {
+            "variant": shape_mask(kind=kind, size=size, variant=1),
+            "bump": perturbed_mask(mask=mask_ref, kind="bump"),
+            "shift": perturbed_mask(mask=mask_ref, kind="shift")
+        }
+        points_ref = extract_contours(image_slice=mask_ref)
+        for group in groups:
+            cases[group].append((points_ref, extract_contours(image_slice=masks_test[group])))
+
+    return cases
+
+
+def main():
+    il, ol = 1, 2
+
+    for size in [256, 512, 1024]:
+        cases = get_cases(size=size)
+        all_cases = [case for group in groups for case in cases[group]]
+        number_of_points = sum(c.size // 2 for points_ref, _ in cases["variant"] for c in points_ref)
+
+        full_msi = {group: np.concatenate([run_msi(r, t, il=il, ol=ol) for r, t in cases[group]])
+                    for group in groups}
+        full_time = sum(best_time(lambda: run_msi(r, t, il=il, ol=ol), repeat=3) for r, t in all_cases)
+        print("%4dx%-4d %5d reference points, full resolution: %.1f ms, MSI %s"
+              % (size, size, number_of_points, full_time * 1e3,
+                 ", ".join("%s %.3f" % (group, full_msi[group].mean()) for group in groups)))
+
+        for name, resampler in settings:
+            resampled_time = sum(best_time(lambda: run_msi(r, t, il=il, ol=ol, resampler=resampler), repeat=3)
+                                 for r, t in all_cases)
+            deviations = []
+            for group in groups:
+                msi = np.concatenate([run_msi(r, t, il=il, ol=ol, resampler=resampler) for r, t in cases[group]])
+                deviation = np.abs(msi - full_msi[group])
+                deviations.append("%s %.3f/%.3f" % (group, deviation.mean(), deviation.max()))
+            print("    %-15s %7.1f ms, speed-up %5.1fx, MSI deviation (mean/max): %s"
+                  % (name, resampled_time * 1e3, full_time / resampled_time, ", ".join(deviations)))
+
+
+if __name__ == '__main__':
+    main()
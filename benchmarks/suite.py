@@ -0,0 +1,243 @@
+"""
+The benchmark suite of the MSI pipeline. It runs offline on synthetic masks and contours
+(circles, ellipses, concave shapes and multi-component slices) at increasing contour lengths.
+
+Each stage is timed on its own (contour extraction, distance table, dense and k-d tree BLD, MSI,
+traditional metrics), then the whole pipeline is timed through MetricsEvaluator on a synthetic dataset.
+The best time of the repeats, the throughput and the peak memory (traced by tracemalloc in a separate run)
+are reported. The results can be saved as JSON and compared with an earlier run.
+
+Usage:
+    python -m benchmarks.suite [--quick] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+import bld.metrics as bldm
+from bld.data import DataDownloader
+from bld.data.dataloader import extract_contours
+from bld.evaluation import MetricsEvaluator, TraditionalMetricsCalculator
+from benchmarks.synthetic import shape_mask, write_dataset
+
+shapes = ("circle", "ellipse", "concave", "multi")
+
+
+def measure(func: Callable[[], object], repeat: int) -> Tuple[float, int]:
+    """
+    Measures the best wall time of the repeats and the peak memory of one more (traced) run.
+
+    Returns:
+        best_time: the best time in seconds
+        peak_memory: the peak of the traced memory allocations in bytes
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return min(times), peak_memory
+
+
+def get_pairs(points_ref: list, points_test: list) -> list:
+    """
+    Pairs the contours of a slice like MSICalculator, and moves the COMs of the test contours.
+    """
+    msi_calc = bldm.MSICalculator(il=1, ol=1, test_points=points_test, ref_points=points_ref)
+
+    return [(r, bldm.move_coms(c_ref=r, c_test=t), t)
+            for r, t in zip(msi_calc.ref_points_in_order, msi_calc.test_points_in_order)]
+
+
+def run_stages(shape: str, size: int, repeat: int) -> list:
+    """
+    Times the stages of the pipeline separately on one synthetic slice.
+    """
+    mask_ref = shape_mask(kind=shape, size=size)
+    mask_test = shape_mask(kind=shape, size=size, variant=1)
+    points_ref = extract_contours(image_slice=mask_ref)
+    points_test = extract_contours(image_slice=mask_test)
+    pairs = get_pairs(points_ref=points_ref, points_test=points_test)
+    number_of_points = sum(r.shape[1] for r, _, _ in pairs)
+    number_of_distances = sum(r.shape[1] * t.shape[1] for r, t, _ in pairs)
+
+    distance_calculators = []
+    for r, tc, _ in pairs:
+        dist_calc = bldm.DistanceCalculator(reference_contour=r, test_contour=tc)
+        dist_calc.run()
+        distance_calculators.append(dist_calc)
+
+    def extract_slice_contours():
+        extract_contours(image_slice=mask_ref)
+        extract_contours(image_slice=mask_test)
+
+    def find_distances():
+        for r, tc, _ in pairs:
+            bldm.DistanceCalculator(reference_contour=r, test_contour=tc).run()
+
+    def find_bld_dense():
+        for dist_calc, (_, _, t) in zip(distance_calculators, pairs):
+            bldm.BLDCalculator(dist_calc=dist_calc, test_points=t).run()
+
+    def find_bld_kdtree():
+        for r, tc, t in pairs:
+            bldm.KDTreeBLDCalculator(reference_points=r, test_corrected_points=tc, test_points=t).run()
+
+    def find_bld_tiled():
+        for r, tc, t in pairs:
+            bldm.TiledBLDCalculator(reference_points=r, test_corrected_points=tc, test_points=t,
+                                    memory_budget=2 ** 22).run()
+
+    def find_msi():
+        bldm.MSICalculator(il=1, ol=1, test_points=points_test, ref_points=points_ref).run()
+
+    def find_traditional_metrics():
+        TraditionalMetricsCalculator(points_test=points_test, points_ref=points_ref,
+                                     slice_mask_ref=mask_ref, slice_mask_test=mask_test)
+
+    stages = [
+        ("contour_extraction", extract_slice_contours, 2, "slices/s"),
+        ("distance_table", find_distances, number_of_distances, "distances/s"),
+        ("bld_dense", find_bld_dense, number_of_points, "points/s"),
+        ("bld_kdtree", find_bld_kdtree, number_of_points, "points/s"),
+        ("bld_tiled", find_bld_tiled, number_of_points, "points/s"),
+        ("msi", find_msi, number_of_points, "points/s"),
+        ("traditional_metrics", find_traditional_metrics, 1, "slices/s"),
+    ]
+
+    results = []
+    for stage, func, amount, unit in stages:
+        best_time, peak_memory = measure(func=func, repeat=repeat)
+        results.append({
+            "stage": stage, "shape": shape, "size": size,
+            "points": number_of_points, "contours": len(pairs),
+            "time": best_time, "throughput": amount / best_time, "unit": unit,
+            "peak_memory": peak_memory
+        })
+
+    return results
+
+
+def run_end_to_end(number_of_slices: int, size: int, repeat: int) -> dict:
+    """
+    Times the whole evaluation of a synthetic patient through MetricsEvaluator (reading the volumes,
+    extracting the contours, MSI and traditional metrics of all the slices).
+    """
+    with tempfile.TemporaryDirectory() as root_folder:
+        write_dataset(folder=root_folder + "/data", number_of_patients=1, shape=(number_of_slices, size, size))
+        ddl = DataDownloader(ref_url="", test_url="", data_folder="data", root_folder=root_folder,
+                             manifest_checksums=False)
+
+        def evaluate():
+            MetricsEvaluator(patient=1, data_downloader=ddl, il=1, ol=1).evaluate()
+
+        best_time, peak_memory = measure(func=evaluate, repeat=repeat)
+
+    return {
+        "stage": "end_to_end", "shape": "prostate_like", "size": size,
+        "points": None, "contours": None,
+        "time": best_time, "throughput": number_of_slices / best_time, "unit": "slices/s",
+        "peak_memory": peak_memory
+    }
+
+
+def get_metadata() -> dict:
+    """
+    The description of the environment of the run.
+    """
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                  text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": revision,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor()
+    }
+
+
+def compare(results: list, baseline: list, threshold: float) -> list:
+    """
+    Compares the times with a baseline run (the cases are matched by stage, shape and size).
+
+    Returns:
+        regressions: the cases which are slower than the baseline by more than the threshold
+    """
+    baseline_times = {(r["stage"], r["shape"], r["size"]): r["time"] for r in baseline}
+    regressions = []
+    for result in results:
+        key = (result["stage"], result["shape"], result["size"])
+        if key not in baseline_times:
+            continue
+        ratio = result["time"] / baseline_times[key]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- slower"
+            regressions.append(result)
+        print("%-20s %-13s %5d: %9.3f ms -> %9.3f ms (%.2fx)%s"
+              % (key + (baseline_times[key] * 1e3, result["time"] * 1e3, ratio, flag)))
+
+    return regressions
+
+
+def main(arguments: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Benchmark suite of the MSI pipeline (offline, synthetic data)")
+    parser.add_argument("--quick", action="store_true", help="only the small sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="the number of timed runs of each case")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results with an earlier JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="the relative slow-down reported as regression (default: 0.2)")
+    args = parser.parse_args(arguments)
+
+    sizes = [64, 128, 256] if args.quick else [64, 128, 256, 512, 1024]
+    results = []
+    for shape in shapes:
+        for size in sizes:
+            for result in run_stages(shape=shape, size=size, repeat=args.repeat):
+                results.append(result)
+                print("%-20s %-13s %5d: %6d points, %9.3f ms, %12.1f %-11s peak memory %8.1f kB"
+                      % (result["stage"], shape, size, result["points"], result["time"] * 1e3,
+                         result["throughput"], result["unit"], result["peak_memory"] / 1024))
+
+    result = run_end_to_end(number_of_slices=20 if args.quick else 60, size=256, repeat=args.repeat)
+    results.append(result)
+    print("%-20s %-13s %5d: %9.3f s, %.1f %s, peak memory %.1f MB"
+          % (result["stage"], result["shape"], result["size"], result["time"],
+             result["throughput"], result["unit"], result["peak_memory"] / 2 ** 20))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": get_metadata(), "results": results}, f, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results=results, baseline=baseline, threshold=args.threshold)
+        print("%d of %d cases are slower than the baseline by more than %d%%"
+              % (len(regressions), len(results), args.threshold * 100))
+
+
+if __name__ == '__main__':
+    main()
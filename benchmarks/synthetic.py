@@ -0,0 +1,126 @@
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+import SimpleITK as SITK
+
+
+def ellipse_volume(shape: Tuple[int, int, int], center: Tuple[float, float, float],
+                   radii: Tuple[float, float, float]) -> np.ndarray:
+    """
+    Creates a binary ellipsoid mask.
+
+    Args:
+        shape: the shape of the volume (slices, rows, columns)
+        center: the center of the ellipsoid (slice, row, column)
+        radii: the radii of the ellipsoid (slice, row, column)
+
+    Returns:
+        mask: uint8 volume, 1 inside the ellipsoid and 0 outside
+    """
+    z, y, x = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    inside = (((z - center[0]) / radii[0]) ** 2 +
+              ((y - center[1]) / radii[1]) ** 2 +
+              ((x - center[2]) / radii[2]) ** 2) < 1
+
+    return inside.astype(np.uint8)
+
+
+def prostate_like_pair(shape: Tuple[int, int, int], seed: Optional[int] = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Creates a reference and a slightly different test volume, which resemble a prostate segmentation.
+    """
+    rng = np.random.default_rng(seed)
+    center = (shape[0] / 2, shape[1] / 2, shape[2] / 2)
+    radii = (shape[0] / 3, shape[1] / 5, shape[2] / 7)
+    ref = ellipse_volume(shape=shape, center=center, radii=radii)
+
+    shift = rng.uniform(-2, 2, size=3) * (0, 1, 1)
+    scale = rng.uniform(0.9, 1.1, size=3)
+    test = ellipse_volume(shape=shape,
+                          center=tuple(np.add(center, shift)),
+                          radii=tuple(np.multiply(radii, scale)))
+
+    return ref, test
+
+
+def write_dataset(folder: str, number_of_patients: int,
+                  shape: Tuple[int, int, int], seed: Optional[int] = 0):
+    """
+    Writes synthetic reference and test masks in the folder layout of DataDownloader
+    (masks_ref and masks_test subfolders with one nii.gz file per patient).
+    """
+    os.makedirs(os.path.join(folder, "masks_ref"), exist_ok=True)
+    os.makedirs(os.path.join(folder, "masks_test"), exist_ok=True)
+
+    for patient in range(number_of_patients):
+        ref, test = prostate_like_pair(shape=shape, seed=seed + patient)
+        for subfolder, volume in (("masks_ref", ref), ("masks_test", test)):
+            image = SITK.GetImageFromArray(volume)
+            SITK.WriteImage(image, os.path.join(folder, subfolder, "case_%03d.nii.gz" % patient))
+
+
+def shape_mask(kind: str, size: int, variant: Optional[int] = 0) -> np.ndarray:
+    """
+    Creates a 2D mask slice with one of the benchmark shapes, the length of the contour grows with the size.
+
+    Args:
+        kind: 'circle', 'ellipse', 'concave' (a star-like shape) or 'multi' (several separate components)
+        size: the number of rows and columns of the slice
+        variant: 0 for the reference shape, other values give slightly different test shapes
+
+    Returns:
+        mask: uint8 slice, 1 inside the shape and 0 outside
+    """
+    y, x = np.mgrid[:size, :size].astype(np.float64)
+    rng = np.random.default_rng(variant)
+    scale = 1 + 0.04 * variant
+    shift = rng.uniform(-0.01, 0.01, size=2) * size if variant != 0 else np.zeros(2)
+
+    def ellipse(center_y: float, center_x: float, radius_y: float, radius_x: float) -> np.ndarray:
+        return (((y - center_y - shift[0]) / (radius_y * scale)) ** 2 +
+                ((x - center_x - shift[1]) / (radius_x / scale)) ** 2) < 1
+
+    if kind == "circle":
+        inside = ellipse(size / 2, size / 2, size / 3, size / 3)
+    elif kind == "ellipse":
+        inside = ellipse(size / 2, size / 2, size / 3, size / 5)
+    elif kind == "concave":
+        angle = np.arctan2(y - size / 2 - shift[0], x - size / 2 - shift[1])
+        radius = np.hypot(y - size / 2 - shift[0], x - size / 2 - shift[1])
+        inside = radius < size / 3.5 * scale * (1 + 0.3 * np.sin(5 * angle + 0.2 * variant))
+    elif kind == "multi":
+        inside = np.zeros((size, size), dtype=bool)
+        for i in range(3):
+            for j in range(3):
+                inside |= ellipse(size * (i + 1) / 4, size * (j + 1) / 4, size / 12, size / 10)
+    else:
+        raise ValueError("Unknown shape: %s" % kind)
+
+    return inside.astype(np.uint8)
+
+
+def perturbed_mask(mask: np.ndarray, kind: str) -> np.ndarray:
+    """
+    Creates a test slice which coincides with most of the reference slice (the contours share most of their points).
+
+    Args:
+        mask: the reference slice
+        kind: 'bump' (a small disk added to the top of the foreground) or 'shift' (moved by one pixel to the right)
+
+    Returns:
+        mask: uint8 slice, 1 inside the shape and 0 outside
+    """
+    if kind == "shift":
+        return np.roll(mask, 1, axis=1)
+    if kind != "bump":
+        raise ValueError("Unknown perturbation: %s" % kind)
+
+    rows, columns = np.nonzero(mask)
+    top = rows.min()
+    center = np.round(columns[rows == top].mean())
+    radius = max(3, mask.shape[1] // 100)
+    y, x = np.mgrid[:mask.shape[0], :mask.shape[1]]
+    bump = (y - top) ** 2 + (x - center) ** 2 < radius ** 2
+
+    return (mask.astype(bool) | bump).astype(np.uint8)
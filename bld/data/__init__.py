@@ -1,2 +1,7 @@
 from .data_downloader import DataDownloader
+from .sources import DataSource, GoogleDriveSource, LocalSource
+from .contour_cache import ContourCache
+from .volume_reader import VolumeReader
+from .bounding_boxes import BoundingBoxes
 from .dataloader import DataLoader
+from .lazy_slices import LazySliceContours, VolumeSlices
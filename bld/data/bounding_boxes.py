@@ -0,0 +1,90 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class BoundingBoxes:
+    """
+    The bounding boxes of the foreground of the union of mask volumes (e.g. the reference and the test volume).
+
+    The foreground rows and columns of all the slices are found in one pass over each volume.
+    The boxes are extended by a margin of background pixels (and clipped to the slice), so that the filters
+    near the foreground (e.g. the edge detection) give the same result on the cropped slices as on the full slices.
+    The coordinates found on a cropped slice are shifted back by the offset of the box.
+
+    Args:
+        volumes: the 3D masks (slices along the first axis), only the common slices are used
+        margin: the number of background pixels kept around the foreground
+
+    Returns:
+        slice_boxes: numpy array of shape (number of slices, 4), the first row, the end row,
+            the first column and the end column of the box of each slice (all zero for the empty slices)
+        is_empty: True for the slices without foreground in all the volumes
+        volume_box: the box of all the slices (first row, end row, first column, end column)
+    """
+
+    def __init__(self, volumes: List[np.ndarray], margin: Optional[int] = 4):
+        self.margin = margin
+        self.number_of_slices = min(volume.shape[0] for volume in volumes)
+        self.shape = tuple(min(volume.shape[axis] for volume in volumes) for axis in (1, 2))
+
+        rows = np.zeros((self.number_of_slices, self.shape[0]), dtype=bool)
+        columns = np.zeros((self.number_of_slices, self.shape[1]), dtype=bool)
+        for volume in volumes:
+            common = volume[:self.number_of_slices, :self.shape[0], :self.shape[1]]
+            rows |= common.any(axis=2)
+            columns |= common.any(axis=1)
+
+        self.is_empty = ~rows.any(axis=1)
+        self.slice_boxes = np.zeros((self.number_of_slices, 4), dtype=np.int_)
+        self.slice_boxes[:, 0], self.slice_boxes[:, 1] = find_ranges(is_foreground=rows, margin=margin)
+        self.slice_boxes[:, 2], self.slice_boxes[:, 3] = find_ranges(is_foreground=columns, margin=margin)
+        self.slice_boxes[self.is_empty] = 0
+
+        row_starts, row_ends = find_ranges(is_foreground=rows.any(axis=0, keepdims=True), margin=margin)
+        column_starts, column_ends = find_ranges(is_foreground=columns.any(axis=0, keepdims=True), margin=margin)
+        self.volume_box = np.array([row_starts[0], row_ends[0], column_starts[0], column_ends[0]], dtype=np.int_)
+        if self.is_empty.all():
+            self.volume_box[:] = 0
+
+    def __len__(self) -> int:
+        return self.number_of_slices
+
+    def get_slices(self, slice_index: int) -> Tuple[slice, slice]:
+        """
+        The row and the column range of the box of a slice (the index of the cropped view).
+        """
+        row_start, row_end, column_start, column_end = self.slice_boxes[slice_index]
+
+        return slice(row_start, row_end), slice(column_start, column_end)
+
+    def get_offset(self, slice_index: int) -> Tuple[int, int]:
+        """
+        The (x, y) coordinates of the first pixel of the box of a slice (the shift of the contour points).
+        """
+        return int(self.slice_boxes[slice_index, 2]), int(self.slice_boxes[slice_index, 0])
+
+    def crop(self, image_slice: np.ndarray, slice_index: int) -> np.ndarray:
+        """
+        The view of the box of a slice.
+        """
+        return image_slice[self.get_slices(slice_index=slice_index)]
+
+    def crop_volume(self, volume: np.ndarray) -> np.ndarray:
+        """
+        The view of the common slices of a volume, cropped to the box of all the slices.
+        """
+        row_start, row_end, column_start, column_end = self.volume_box
+
+        return volume[:self.number_of_slices, row_start:row_end, column_start:column_end]
+
+
+def find_ranges(is_foreground: np.ndarray, margin: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the first and the end index of the foreground in each row of a boolean array, extended by the margin.
+    """
+    length = is_foreground.shape[1]
+    starts = np.argmax(is_foreground, axis=1)
+    ends = length - np.argmax(is_foreground[:, ::-1], axis=1)
+
+    return np.maximum(starts - margin, 0), np.minimum(ends + margin, length)
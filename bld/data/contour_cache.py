@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import numpy as np
+
+from bld.data.patient_manifest import find_checksum
+
+
+class ContourCache:
+    """
+    Stores the contours extracted from the mask files on the disk, so that repeated evaluations
+    (e.g. with different il and ol values) do not have to extract them again.
+
+    The contours of a file are stored in one uncompressed npz file, named by a key which depends on
+    the file (path, size and modification time, or the hash of the content) and the extraction parameters.
+    If the total size of the cache exceeds the limit, the least recently used files are deleted.
+
+    Args:
+        cache_folder: the folder of the cache files
+        max_size: the maximal total size of the cache files in bytes (None: no limit)
+        use_content_hash: if True, the key is based on the content of the file instead of
+            its path, size and modification time (slower, but it survives moving the files)
+
+    Returns:
+        hits: the number of files found in the cache
+        misses: the number of files not found in the cache
+    """
+
+    version = 1
+
+    def __init__(self, cache_folder: str, max_size: Optional[int] = 2 ** 30,
+                 use_content_hash: Optional[bool] = False):
+        self.cache_folder = cache_folder
+        self.max_size = max_size
+        self.use_content_hash = use_content_hash
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+        os.makedirs(self.cache_folder, exist_ok=True)
+        self.evict()
+
+    def get_key(self, file_path: str, parameters: dict) -> str:
+        """
+        Creates the key of a mask file and the extraction parameters.
+        """
+        if self.use_content_hash:
+            file_id = {"sha256": find_checksum(file_path=file_path)}
+        else:
+            stat = os.stat(file_path)
+            file_id = {"path": os.path.abspath(file_path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+        description = json.dumps({"version": ContourCache.version, "file": file_id, "parameters": parameters},
+                                 sort_keys=True)
+
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_folder, key + '.npz')
+
+    def load(self, file_path: str, parameters: dict) -> Optional[dict]:
+        """
+        Loads the contours of a mask file, returns None if they are not in the cache.
+        """
+        path = self.get_path(key=self.get_key(file_path=file_path, parameters=parameters))
+        try:
+            with np.load(path) as data:
+                contours = unpack_contours(points=data['points'],
+                                           contour_lengths=data['contour_lengths'],
+                                           slice_counts=data['slice_counts'])
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+
+        # the modification time of the cache file shows when it was used last
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+
+        return contours
+
+    def save(self, file_path: str, parameters: dict, contours: dict):
+        """
+        Saves the contours of a mask file, then deletes the least recently used files if the cache is too large.
+        """
+        points, contour_lengths, slice_counts = pack_contours(contours=contours)
+        path = self.get_path(key=self.get_key(file_path=file_path, parameters=parameters))
+
+        # write to a temporary file first, so that parallel loaders never read a partial file
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_folder, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, points=points, contour_lengths=contour_lengths, slice_counts=slice_counts)
+        os.replace(temp_path, path)
+
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used cache files until the total size is below the limit.
+        """
+        if self.max_size is None:
+            return
+
+        files = []
+        for entry in os.scandir(self.cache_folder):
+            if entry.name.endswith('.npz'):
+                stat = entry.stat()
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        """
+        Deletes all the cache files.
+        """
+        for entry in os.scandir(self.cache_folder):
+            if entry.name.endswith('.npz'):
+                os.remove(entry.path)
+
+
+def pack_contours(contours: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Concatenates the contours of all slices to one array.
+
+    Returns:
+        points: all the contour points, shape (2, number of points)
+        contour_lengths: the number of points of each contour
+        slice_counts: the number of contours of each slice
+    """
+    arrays = [c.reshape((2, -1)) for i in range(len(contours)) for c in contours['slice' + str(i)]]
+    slice_counts = np.array([len(contours['slice' + str(i)]) for i in range(len(contours))], dtype=np.int64)
+    contour_lengths = np.array([a.shape[1] for a in arrays], dtype=np.int64)
+    points = np.concatenate(arrays, axis=1) if len(arrays) > 0 else np.zeros((2, 0), dtype=np.int32)
+
+    return points, contour_lengths, slice_counts
+
+
+def unpack_contours(points: np.ndarray, contour_lengths: np.ndarray, slice_counts: np.ndarray) -> dict:
+    """
+    Splits the concatenated points to the contours of the slices (the inverse of pack_contours).
+    Single point contours are 1D arrays, like the squeezed output of cv.findContours.
+    """
+    arrays = np.split(points, np.cumsum(contour_lengths)[:-1], axis=1) if len(contour_lengths) > 0 else []
+    arrays = [a[:, 0] if a.shape[1] == 1 else a for a in arrays]
+
+    contours = dict()
+    start = 0
+    for i, count in enumerate(slice_counts):
+        contours['slice' + str(i)] = arrays[start:start + count]
+        start += count
+
+    return contours
@@ -1,58 +1,218 @@
+from concurrent.futures import ThreadPoolExecutor
+import glob
 import os
-from typing import Optional
+import shutil
+from typing import Optional, Tuple, Union
+import warnings
 import zipfile
 
-import gdown
+from bld.data.patient_manifest import PatientManifest, find_checksum
+from bld.data.sources import DataSource, create_source
 
 
 class DataDownloader:
     """Downloads all the necessary data from the cloud, including masks and manual scores.
 
+    The reference and the test archives are fetched and extracted concurrently.
+    Interrupted downloads are resumed, the archives are verified (with the SHA-256 checksums, if they are given),
+    and the members which are already extracted are skipped, so an interrupted run is repaired by the next one.
+    A folder is complete when its marker file (.complete) exists.
+
     Args:
         ref_url: the link of the directory containing the reference masks.
-        test_url: the link of the directory containing the test masks.
+            It can also be a local path or a file:// URL of an archive or a folder of masks, or a DataSource.
+        test_url: the link of the directory containing the test masks (the same kinds as ref_url).
         data_folder: the folder which will be used for data storage
         root_folder: the root folder
+        manifest_checksums: if True, the patient manifest contains the SHA-256 checksums of the files
+        ref_checksum: the SHA-256 checksum of the reference archive (None: only the zip structure is checked)
+        test_checksum: the SHA-256 checksum of the test archive
+        max_workers: the number of threads extracting the members of an archive
 
     Returns:
         download the files to the specified directory
+        manifest: the index of the patients (built at the first use of the data folder, then loaded,
+            rebuilt when the modification time of a mask folder changes)
     """
 
-    def __init__(self, ref_url: str, test_url: str, data_folder: Optional[str] = "data",
-                 root_folder: Optional[str] = "./"):
+    # the name of the marker file of the completely extracted folders
+    marker_name = ".complete"
+
+    def __init__(self, ref_url: Union[str, DataSource], test_url: Union[str, DataSource],
+                 data_folder: Optional[str] = "data",
+                 root_folder: Optional[str] = "./", manifest_checksums: Optional[bool] = True,
+                 ref_checksum: Optional[str] = None, test_checksum: Optional[str] = None,
+                 max_workers: Optional[int] = 4):
         self.root_folder = root_folder
         self.data_folder = data_folder
         self.ref_url = ref_url
         self.test_url = test_url
+        self.ref_checksum = ref_checksum
+        self.test_checksum = test_checksum
+        self.max_workers = max_workers
+
+        self.labels_ref: Optional[list] = None
+        self.labels_test: Optional[list] = None
 
         self.download_files()
 
+        self.manifest = PatientManifest(folder=os.path.join(self.root_folder, self.data_folder),
+                                        checksums=manifest_checksums)
+        self.manifest.load_or_build()
+        self.warn_mismatches()
+
     def download_files(self):
         """
         Download all the currently available reference and test segmentations.
         Create a folder for the reference files (masks_ref) and test files (masks_test) in the data folder.
+        The two archives are processed in parallel, the complete folders are skipped.
+        """
+        folder = os.path.join(self.root_folder, self.data_folder)
+        os.makedirs(folder, exist_ok=True)
+
+        datasets = [("masks_ref", self.ref_url, self.ref_checksum), ("masks_test", self.test_url, self.test_checksum)]
+        with ThreadPoolExecutor(max_workers=len(datasets)) as pool:
+            futures = [pool.submit(self.prepare_dataset, name, url, checksum) for name, url, checksum in datasets]
+            for future in futures:
+                future.result()
+
+    def prepare_dataset(self, name: str, url: Union[str, DataSource], checksum: Optional[str] = None):
+        """
+        Fetches, verifies and extracts one dataset (masks_ref or masks_test), if its folder is not complete.
+
+        Args:
+            name: the name of the folder of the dataset in the data folder
+            url: the location of the archive (or the folder) of the dataset
+            checksum: the SHA-256 checksum of the archive
+        """
+        folder = os.path.join(self.root_folder, self.data_folder)
+        output_folder = os.path.join(folder, name)
+        archive = os.path.join(folder, name + ".zip")
+        marker = os.path.join(output_folder, DataDownloader.marker_name)
+
+        if os.path.exists(marker):
+            return
+        # the folders extracted by earlier versions (without marker and without a leftover archive) are complete
+        if os.path.isdir(output_folder) and len(glob.glob(glob.escape(archive) + "*")) == 0:
+            return
+
+        source = create_source(location=url)
+        os.makedirs(output_folder, exist_ok=True)
+        if source.is_folder:
+            copy_files(files=source.list_files(), folder=output_folder)
+        else:
+            if not is_valid_archive(path=archive, checksum=checksum):
+                # a complete but invalid archive is removed, otherwise the resumed download would keep it
+                if os.path.exists(archive):
+                    os.remove(archive)
+                source.fetch(destination=archive)
+                if not is_valid_archive(path=archive, checksum=checksum):
+                    os.remove(archive)
+                    raise ValueError("The downloaded archive is corrupt or its checksum differs: %s" % archive)
+            extract_archive(path=archive, folder=output_folder, max_workers=self.max_workers)
+
+        with open(marker, 'w'):
+            pass
+
+    def update_manifest(self):
+        """
+        Rebuilds the patient manifest (e.g. after files were added to the data folder).
+        """
+        self.manifest.build()
+        self.manifest.save()
+        self.labels_ref = None
+        self.labels_test = None
+        self.warn_mismatches()
+
+    def refresh_manifest(self):
+        """
+        Rebuilds the patient manifest if the mask folders changed since it was built
+        (one stat per folder). It is called once per cohort, not at each lookup.
+        """
+        if not self.manifest.is_up_to_date():
+            self.update_manifest()
+
+    def warn_mismatches(self):
+        """
+        Warns about the reference and test files which do not match.
+        """
+        for mismatch in self.manifest.mismatches:
+            warnings.warn("Mismatched masks in %s: %s" % (self.manifest.folder, mismatch))
+
+    def get_labels(self) -> Tuple[list, list]:
+        """
+        Finds the labels (paths) of the reference and test files in natural order.
+        The labels are taken from the patient manifest at the first call (and after the manifest was rebuilt),
+        the DataLoaders of all patients share the result.
+
+        Returns:
+            labels_ref: the labels of the reference files
+            labels_test: the labels of the test files
         """
-        if not os.path.isdir(os.path.join(self.root_folder, self.data_folder)):
-            os.makedirs(self.data_folder, exist_ok=True)
-            
-            gdown.download(
-                url=self.ref_url,
-                output=os.path.join(self.root_folder, self.data_folder, "masks_ref.zip"),
-                quiet=False
-            )
-            gdown.download(
-                url=self.test_url,
-                output=os.path.join(self.root_folder, self.data_folder, "masks_test.zip"),
-                quiet=False
-            )
-        
-            with zipfile.ZipFile(
-                    file=os.path.join(self.root_folder, self.data_folder, "masks_ref.zip"),
-                    mode='r') as zip_ref:
-                zip_ref.extractall(
-                    path=os.path.join(self.root_folder, self.data_folder, "masks_ref"))
-            with (zipfile.ZipFile(
-                    file=os.path.join(self.root_folder, self.data_folder, "masks_test.zip"),
-                    mode='r') as zip_test):
-                zip_test.extractall(
-                    path=os.path.join(self.root_folder, self.data_folder, "masks_test"))
+        if self.labels_ref is None or self.labels_test is None:
+            self.labels_ref, self.labels_test = self.manifest.get_labels()
+
+        return self.labels_ref, self.labels_test
+
+    def get_patient_files(self, patient: int) -> Tuple[str, str]:
+        """
+        Finds the paths of the reference and the test file of a patient (first patient: 1).
+        An unknown patient may have been added since the manifest was built, then the manifest is refreshed.
+        """
+        if patient not in self.manifest.patients:
+            self.refresh_manifest()
+
+        return self.manifest.get_files(patient=patient)
+
+
+def is_valid_archive(path: str, checksum: Optional[str] = None) -> bool:
+    """
+    Checks if an archive exists and it is complete: its checksum is the expected one,
+    or (without checksum) its zip structure can be read.
+    """
+    if not os.path.isfile(path):
+        return False
+    if checksum is not None:
+        return find_checksum(file_path=path) == checksum.lower()
+
+    return zipfile.is_zipfile(path)
+
+
+def extract_archive(path: str, folder: str, max_workers: Optional[int] = 4):
+    """
+    Extracts the members of an archive, which are not extracted yet (or their size differs), in parallel.
+    Each thread reads the archive with its own handle, the decompression runs in parallel.
+    """
+    with zipfile.ZipFile(file=path, mode='r') as archive:
+        members = [member for member in archive.infolist() if not member.is_dir() and not is_extracted(
+            member=member, folder=folder)]
+
+    def extract(chunk: list):
+        with zipfile.ZipFile(file=path, mode='r') as handle:
+            for member in chunk:
+                handle.extract(member=member, path=folder)
+
+    number_of_chunks = max(1, min(max_workers, len(members)))
+    chunks = [members[i::number_of_chunks] for i in range(number_of_chunks)]
+    with ThreadPoolExecutor(max_workers=number_of_chunks) as pool:
+        list(pool.map(extract, chunks))
+
+
+def is_extracted(member: zipfile.ZipInfo, folder: str) -> bool:
+    """
+    Checks if a member of an archive is already extracted (the file exists with the same size).
+    """
+    target = os.path.join(folder, member.filename)
+
+    return os.path.isfile(target) and os.path.getsize(target) == member.file_size
+
+
+def copy_files(files: list, folder: str):
+    """
+    Copies the files to a folder, the files which already exist with the same size are skipped.
+    """
+    for file_path in files:
+        target = os.path.join(folder, os.path.basename(file_path))
+        if not (os.path.isfile(target) and os.path.getsize(target) == os.path.getsize(file_path)):
+            shutil.copyfile(file_path, target + ".part")
+            os.replace(target + ".part", target)
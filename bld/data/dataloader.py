@@ -1,11 +1,16 @@
-import glob
+from collections.abc import Mapping
 import os
+from typing import Optional
 
 import cv2 as cv
-from natsort import natsorted
-import SimpleITK as SITK
+import numpy as np
 
 from bld.data import DataDownloader
+from bld.data.bounding_boxes import BoundingBoxes
+from bld.data.contour_cache import ContourCache
+from bld.data.lazy_slices import LazySliceContours, VolumeSlices
+from bld.data.volume_reader import VolumeReader
+from bld.utils.profiling import Profiler
 
 
 class DataLoader:
@@ -15,31 +20,97 @@ class DataLoader:
     Args:
         patient: patient number
         data_downloader: data downloader object
+        in_memory: if True, the contours are extracted directly from the image array,
+            otherwise every slice is written to and read back from a temporary png file
+        lazy: if True, the volumes are read once and the contours of a slice are only extracted
+            when the slice is first accessed, otherwise all the slices are processed at once
+        contour_cache: if given, the contours of the files are loaded from (and saved to) this cache
+            (in lazy mode, cached contours are used, but partially extracted volumes are not saved)
+        volume_reader: reads the volumes (None: a new reader, which reads each file of the patient once)
+        profiler: records the time of reading the volumes and of the contour extraction of each slice
+        crop: if True, the contours are extracted from the bounding boxes of the union of the reference
+            and the test foreground (the contours are the same), the empty slices are skipped
 
     Returns:
         labels_test: the labels (paths) of all the patient to the test contours
         labels_ref: the labels (paths) of all the patient to the reference contours
+        file_ref: the path of the reference file of the patient
+        file_test: the path of the test file of the patient
         c_ref: reference contours with coordinates
         c_test: test contours with coordinates
         mask_test: test masks in np arrays
         mask_ref: reference masks in np arrays
+        bounding_boxes: the bounding boxes of the slices (None if crop is False)
+        volume_test: the test mask volume
+        volume_ref: the reference mask volume
 
     """
-    def __init__(self, patient: int, data_downloader: DataDownloader):
+    # the thresholds of the Canny edge detection
+    canny_thresholds = (30, 200)
+
+    def __init__(self, patient: int, data_downloader: DataDownloader,
+                 in_memory: Optional[bool] = True, lazy: Optional[bool] = False,
+                 contour_cache: Optional[ContourCache] = None,
+                 volume_reader: Optional[VolumeReader] = None,
+                 profiler: Optional[Profiler] = None, crop: Optional[bool] = True):
         self.folder = os.path.join(data_downloader.root_folder, data_downloader.data_folder)
         self.patient = patient
+        self.in_memory = in_memory
+        self.lazy = lazy
+        self.contour_cache = contour_cache
+        self.volume_reader = VolumeReader() if volume_reader is None else volume_reader
+        self.profiler = Profiler(enabled=False) if profiler is None else profiler
+        self.crop = crop
+        self.data_downloader = data_downloader
 
         self.labels_test: list = []
         self.labels_ref: list = []
-        self.c_ref: dict = dict()
-        self.c_test: dict = dict()
+        self.file_ref, self.file_test = data_downloader.get_patient_files(patient=patient)
+        self.c_ref: Mapping = dict()
+        self.c_test: Mapping = dict()
+        self.mask_test: Mapping = dict()
+        self.mask_ref: Mapping = dict()
+        self.volume_test: Optional[np.ndarray] = None
+        self.volume_ref: Optional[np.ndarray] = None
+        self.bounding_boxes: Optional[BoundingBoxes] = None
 
         self.get_the_labels()
-        self.get_contours(number=patient)
+        if self.crop:
+            self.get_bounding_boxes()
+        if self.lazy:
+            self.get_lazy_slices()
+        else:
+            self.get_contours(number=patient)
+            self.get_masks()
+
+    def get_bounding_boxes(self):
+        """
+        Finds the bounding boxes of the foreground of the reference and the test volume (once for the patient).
+        """
+        volumes = [self.read_volume(file_path=self.file_ref), self.read_volume(file_path=self.file_test)]
+        with self.profiler.stage("bounding_boxes", size=sum(volume.size for volume in volumes)):
+            self.bounding_boxes = BoundingBoxes(volumes=volumes)
+
+    def get_lazy_slices(self):
+        """
+        Reads the volumes of the patient once and creates the slice accessors.
+        The contours and the masks of a slice are provided on first access, without copying the volume.
+        """
+        self.volume_ref = self.read_volume(file_path=self.file_ref)
+        self.volume_test = self.read_volume(file_path=self.file_test)
+
+        self.c_ref = self.get_cached_contours(file_path=self.file_ref)
+        if self.c_ref is None:
+            self.c_ref = LazySliceContours(volume=self.volume_ref, extract=self.get_contour_from_volume_slice,
+                                           profiler=self.profiler)
+        self.c_test = self.get_cached_contours(file_path=self.file_test)
+        if self.c_test is None:
+            self.c_test = LazySliceContours(volume=self.volume_test, extract=self.get_contour_from_volume_slice,
+                                            profiler=self.profiler)
 
-        self.mask_test: dict = dict()
-        self.mask_ref: dict = dict()
-        self.get_masks()
+        number_of_slices = min(self.volume_test.shape[0], self.volume_ref.shape[0])
+        self.mask_ref = VolumeSlices(volume=self.volume_ref, number_of_slices=number_of_slices)
+        self.mask_test = VolumeSlices(volume=self.volume_test, number_of_slices=number_of_slices)
 
     def get_contours(self, number: int):
         """
@@ -52,8 +123,9 @@ class DataLoader:
             c_ref: the reference contour(s)
             c_test: the test contour(s)
         """
-        self.c_ref = self.get_contour_from_image(file_path=self.labels_ref[number - 1])
-        self.c_test = self.get_contour_from_image(file_path=self.labels_test[number - 1])
+        file_ref, file_test = self.data_downloader.get_patient_files(patient=number)
+        self.c_ref = self.get_contour_from_image(file_path=file_ref)
+        self.c_test = self.get_contour_from_image(file_path=file_test)
 
     def get_the_labels(self):
         """
@@ -63,8 +135,7 @@ class DataLoader:
         labels_ref: the labels of the reference files
         labels_test: the labels of the test files
         """
-        self.labels_test = natsorted(glob.glob(os.path.join(self.folder, "masks_test", "*")))
-        self.labels_ref = natsorted(glob.glob(os.path.join(self.folder, "masks_ref", "*")))
+        self.labels_ref, self.labels_test = self.data_downloader.get_labels()
 
     def get_contour_from_image(self, file_path: str) -> dict:
         """
@@ -79,40 +150,152 @@ class DataLoader:
             values - contours of the corresponding slice, each contour is one 2D numpy array
             with the coordinates of the contour points
         """
+        dictionary_contours = self.get_cached_contours(file_path=file_path)
+        if dictionary_contours is not None:
+            return dictionary_contours
 
-        im = SITK.ReadImage(fileName=file_path)
-        img = SITK.GetArrayFromImage(image=im)
+        img = self.read_volume(file_path=file_path)
 
         # initialize dictionary
         dictionary_contours = dict()
         # get the contours
         for i in range(img.shape[0]):
-            f_path = os.path.join(self.folder, 'image.png')
-            cv.imwrite(f_path, img[i] * 255)
-            image = cv.imread(f_path)
-            gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
-            edged = cv.Canny(gray, 30, 200)
-            contours, hierarchy = cv.findContours(
-                edged, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_NONE)
-
-            c = []
-            for contour in contours:
-                c.append(contour.T.squeeze())
-            dictionary_contours['slice' + str(i)] = c
+            with self.profiler.stage("extract_contours", size=img[i].size, slice_index=i):
+                dictionary_contours['slice' + str(i)] = self.get_contour_from_volume_slice(volume=img, slice_index=i)
+
+        if self.contour_cache is not None:
+            self.contour_cache.save(file_path=file_path, parameters=self.get_contour_parameters(),
+                                    contours=dictionary_contours)
 
         return dictionary_contours
 
+    def read_volume(self, file_path: str) -> np.ndarray:
+        """
+        Reads a volume with the volume reader (the read_volume stage of the profiler).
+        """
+        with self.profiler.stage("read_volume") as stage:
+            volume = self.volume_reader.read(file_path=file_path)
+            stage.set_size(volume.size)
+
+        return volume
+
+    def get_contour_parameters(self) -> dict:
+        """
+        The parameters of the contour extraction (part of the key of the contour cache).
+        """
+        return {
+            "in_memory": bool(self.in_memory),
+            "canny_thresholds": list(DataLoader.canny_thresholds),
+            "mode": "RETR_EXTERNAL",
+            "method": "CHAIN_APPROX_NONE"
+        }
+
+    def get_cached_contours(self, file_path: str) -> Optional[dict]:
+        """
+        Loads the contours of a file from the contour cache (None if there is no cache or the file is not cached).
+        """
+        if self.contour_cache is None:
+            return None
+
+        with self.profiler.stage("load_contours"):
+            return self.contour_cache.load(file_path=file_path, parameters=self.get_contour_parameters())
+
+    def get_contour_from_volume_slice(self, volume: np.ndarray, slice_index: int) -> list:
+        """
+        Finds the contours of one slice of a volume. If the bounding boxes are known,
+        the contours are extracted from the box of the slice, the empty slices have no contours.
+        """
+        if self.bounding_boxes is None or slice_index >= len(self.bounding_boxes):
+            return self.get_contour_from_slice(image_slice=volume[slice_index])
+        if self.bounding_boxes.is_empty[slice_index]:
+            return []
+
+        return self.get_contour_from_slice(
+            image_slice=self.bounding_boxes.crop(image_slice=volume[slice_index], slice_index=slice_index),
+            offset=self.bounding_boxes.get_offset(slice_index=slice_index))
+
+    def get_contour_from_slice(self, image_slice: np.ndarray, offset: Optional[tuple] = (0, 0)) -> list:
+        """
+        Finds the contours of one image slice.
+
+        Args:
+            image_slice: the 2D numpy array of the mask slice
+            offset: the (x, y) shift of the contour points (the position of a cropped slice)
+
+        Returns:
+            c: the contours of the slice, each contour is one 2D numpy array
+            with the coordinates of the contour points
+        """
+        if self.in_memory:
+            return extract_contours(image_slice=image_slice, offset=offset)
+
+        f_path = os.path.join(self.folder, 'image.png')
+        cv.imwrite(f_path, image_slice * 255)
+        image = cv.imread(f_path)
+        gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+
+        return find_contours(gray=gray, offset=offset)
+
     def get_masks(self):
         """
         Creates a dictionary for a patient, contains the slice masks in np array.
         """
-        labels_test = natsorted(glob.glob(os.path.join(self.folder, "masks_test/*")))
-        labels_ref = natsorted(glob.glob(os.path.join(self.folder, "masks_ref/*")))
-        mask_t = SITK.ReadImage(fileName=labels_test[self.patient - 1])
-        mask_r = SITK.ReadImage(fileName=labels_ref[self.patient - 1])
-        test = SITK.GetArrayFromImage(image=mask_t)
-        ref = SITK.GetArrayFromImage(image=mask_r)
+        # the volumes were already read for the contours, the slice masks are views of the volumes
+        test = self.read_volume(file_path=self.file_test)
+        ref = self.read_volume(file_path=self.file_ref)
+        self.volume_test = test
+        self.volume_ref = ref
         number_of_slices = min(test.shape[0], ref.shape[0])
         for i in range(number_of_slices):
             self.mask_test['slice' + str(i)] = test[i, :, :]
             self.mask_ref['slice' + str(i)] = ref[i, :, :]
+
+
+def to_gray_image(image_slice: np.ndarray) -> np.ndarray:
+    """
+    Converts a mask slice to the 8-bit grayscale image used for the edge detection.
+
+    For 8-bit masks the result is identical to writing the scaled slice to a png file and
+    reading it back as a grayscale image, other types are rounded and saturated to the 0-255 range.
+
+    Args:
+        image_slice: one 2D slice of the mask
+
+    Returns:
+        gray: the 8-bit grayscale image
+    """
+    scaled = image_slice * 255
+    if scaled.dtype == np.uint8:
+        return np.ascontiguousarray(scaled)
+
+    return np.clip(np.rint(scaled), 0, 255).astype(np.uint8)
+
+
+def extract_contours(image_slice: np.ndarray, offset: Optional[tuple] = (0, 0)) -> list:
+    """
+    Finds the contours of one mask slice in memory (without a DataLoader, e.g. for synthetic slices).
+
+    Args:
+        image_slice: the 2D numpy array of the mask slice
+        offset: the (x, y) shift of the contour points (the position of a cropped slice)
+
+    Returns:
+        c: the contours of the slice, each contour is one 2D numpy array
+        with the coordinates of the contour points
+    """
+    return find_contours(gray=to_gray_image(image_slice=image_slice), offset=offset)
+
+
+def find_contours(gray: np.ndarray, offset: Optional[tuple] = (0, 0)) -> list:
+    """
+    Finds the external contours of the edges of an 8-bit grayscale image.
+    """
+    edged = cv.Canny(gray, *DataLoader.canny_thresholds)
+    contours, hierarchy = cv.findContours(
+        edged, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_NONE, offset=offset)
+
+    c = []
+    for contour in contours:
+        c.append(contour.T.squeeze())
+
+    return c
@@ -0,0 +1,74 @@
+from collections.abc import Mapping
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+
+from bld.utils.profiling import Profiler
+
+
+def get_slice_index(key: str, number_of_slices: int) -> int:
+    """
+    Converts a slice name ('slice0', 'slice1', ...) to the index of the slice.
+    """
+    if isinstance(key, str) and key.startswith('slice') and key[5:].isdigit():
+        index = int(key[5:])
+        if index < number_of_slices and key == 'slice' + str(index):
+            return index
+
+    raise KeyError(key)
+
+
+class VolumeSlices(Mapping):
+    """
+    Dictionary-like access to the slices of a volume without copying them.
+
+    Args:
+        volume: the 3D numpy array (slices along the first axis)
+        number_of_slices: the number of accessible slices (None: all slices of the volume)
+
+    Returns:
+        the keys are 'slice0', 'slice1', ..., the values are views of the corresponding 2D slices
+    """
+
+    def __init__(self, volume: np.ndarray, number_of_slices: Optional[int] = None):
+        self.volume = volume
+        self.number_of_slices = volume.shape[0] if number_of_slices is None else number_of_slices
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.volume[get_slice_index(key=key, number_of_slices=self.number_of_slices)]
+
+    def __iter__(self) -> Iterator[str]:
+        return ('slice' + str(i) for i in range(self.number_of_slices))
+
+    def __len__(self) -> int:
+        return self.number_of_slices
+
+
+class LazySliceContours(VolumeSlices):
+    """
+    Dictionary-like access to the contours of the slices of a volume.
+    The contours of a slice are extracted at the first access, then they are stored.
+
+    Args:
+        volume: the 3D numpy array (slices along the first axis)
+        extract: the function which finds the contours of one slice (arguments: the volume and the slice index)
+        profiler: records the time of the contour extraction of each slice
+
+    Returns:
+        the keys are 'slice0', 'slice1', ..., the values are the lists of the contours of the slices
+    """
+
+    def __init__(self, volume: np.ndarray, extract: Callable[[np.ndarray, int], list],
+                 profiler: Optional[Profiler] = None):
+        super().__init__(volume=volume)
+        self.extract = extract
+        self.profiler = Profiler(enabled=False) if profiler is None else profiler
+        self.contours: dict = dict()
+
+    def __getitem__(self, key: str) -> list:
+        if key not in self.contours:
+            slice_index = get_slice_index(key=key, number_of_slices=self.number_of_slices)
+            with self.profiler.stage("extract_contours", size=self.volume[slice_index].size, slice_index=slice_index):
+                self.contours[key] = self.extract(self.volume, slice_index)
+
+        return self.contours[key]
@@ -0,0 +1,227 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional, Tuple
+
+from natsort import natsorted
+import SimpleITK as SITK
+
+
+class PatientManifest:
+    """
+    The index of the patients of the data folder, stored in a JSON file next to the masks.
+
+    The masks_ref and masks_test folders are only scanned when the manifest is built,
+    later the paths of a patient are looked up in a dictionary. The modification times of the folders
+    are stored as well, and the manifest is rebuilt if they change (e.g. files were added, removed or renamed),
+    which takes one stat per folder. A file overwritten in place does not change the modification time
+    of its folder, so it is not detected (and its checksum is stale): verify compares the checksums
+    of a patient, DataDownloader.update_manifest rebuilds the manifest.
+    The patients are numbered from 1 in the natural order of the file names,
+    the reference and test files are paired in this order.
+    The shape of each volume is read from the header of the file, the SHA-256 checksums are optional.
+    The pairs which do not match are reported in mismatches.
+
+    Args:
+        folder: the data folder (containing the masks_ref and masks_test folders)
+        file_name: the name of the manifest file in the data folder
+        checksums: if True, the SHA-256 checksum of each file is stored
+
+    Returns:
+        patients: the entries of the patients (patient number: paths, shapes and checksums)
+        unpaired: the files without a pair (if the number of reference and test files differs)
+        mismatches: the description of the problems found while pairing the files
+        folder_state: the modification time (ns) of each mask folder when the manifest was built
+    """
+
+    version = 2
+    folder_names = ("masks_ref", "masks_test")
+
+    def __init__(self, folder: str, file_name: Optional[str] = "manifest.json",
+                 checksums: Optional[bool] = True):
+        self.folder = folder
+        self.path = os.path.join(folder, file_name)
+        self.checksums = checksums
+
+        self.patients: dict = dict()
+        self.unpaired: list = []
+        self.mismatches: list = []
+        self.folder_state: dict = dict()
+
+    def __len__(self) -> int:
+        return len(self.patients)
+
+    def load_or_build(self):
+        """
+        Loads the manifest file, builds (and saves) the manifest if there is no valid manifest file.
+        """
+        if not self.load():
+            self.build()
+            self.save()
+
+    def load(self) -> bool:
+        """
+        Loads the manifest file, returns False if there is no manifest file, it was written by another version,
+        it has no checksums, but they are required, or the mask folders changed since it was built.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if content.get("version") != PatientManifest.version or (self.checksums and not content.get("checksums")):
+            return False
+        if content.get("folders") != self.find_folder_state():
+            return False
+
+        self.patients = {int(patient): entry for patient, entry in content["patients"].items()}
+        self.unpaired = content["unpaired"]
+        self.mismatches = content["mismatches"]
+        self.folder_state = content["folders"]
+
+        return True
+
+    def save(self):
+        """
+        Saves the manifest file (to a temporary file first, so that a partial file is never loaded).
+        """
+        content = {
+            "version": PatientManifest.version,
+            "checksums": bool(self.checksums),
+            "patients": {str(patient): entry for patient, entry in self.patients.items()},
+            "unpaired": self.unpaired,
+            "mismatches": self.mismatches,
+            "folders": self.folder_state
+        }
+        handle, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(handle, 'w') as f:
+            json.dump(content, f, indent=1)
+        os.replace(temp_path, self.path)
+
+    def build(self):
+        """
+        Scans the mask folders, pairs the files and checks the pairs.
+        """
+        # the state is taken first, so that the changes made during the scan are found later
+        self.folder_state = self.find_folder_state()
+        files_ref = natsorted(glob.glob(os.path.join(self.folder, "masks_ref", "*")))
+        files_test = natsorted(glob.glob(os.path.join(self.folder, "masks_test", "*")))
+
+        self.patients = dict()
+        self.mismatches = []
+        self.unpaired = [self.get_relative_path(f) for f in files_ref[len(files_test):] + files_test[len(files_ref):]]
+        if len(files_ref) != len(files_test):
+            self.mismatches.append("the number of reference (%d) and test (%d) files differs"
+                                   % (len(files_ref), len(files_test)))
+
+        # if the folders use the same file names, the files of a pair must have the same name
+        names_ref = [os.path.basename(f) for f in files_ref]
+        names_test = [os.path.basename(f) for f in files_test]
+        is_named_alike = len(set(names_ref) & set(names_test)) > 0
+
+        for patient, (file_ref, file_test) in enumerate(zip(files_ref, files_test), start=1):
+            entry = {
+                "ref": self.get_relative_path(file_ref),
+                "test": self.get_relative_path(file_test),
+                "ref_shape": read_shape(file_path=file_ref),
+                "test_shape": read_shape(file_path=file_test)
+            }
+            if self.checksums:
+                entry["ref_sha256"] = find_checksum(file_path=file_ref)
+                entry["test_sha256"] = find_checksum(file_path=file_test)
+            self.patients[patient] = entry
+
+            if is_named_alike and os.path.basename(file_ref) != os.path.basename(file_test):
+                self.mismatches.append("patient %d: the names of the files differ (%s, %s)"
+                                       % (patient, entry["ref"], entry["test"]))
+            if entry["ref_shape"] != entry["test_shape"]:
+                self.mismatches.append("patient %d: the shapes of the volumes differ (%s, %s)"
+                                       % (patient, entry["ref_shape"], entry["test_shape"]))
+
+    def find_folder_state(self) -> dict:
+        """
+        The modification time (ns) of each mask folder (None for a missing folder).
+        """
+        state = dict()
+        for name in PatientManifest.folder_names:
+            try:
+                state[name] = os.stat(os.path.join(self.folder, name)).st_mtime_ns
+            except OSError:
+                state[name] = None
+
+        return state
+
+    def is_up_to_date(self) -> bool:
+        """
+        Checks if the mask folders are unchanged since the manifest was built.
+        """
+        return self.folder_state == self.find_folder_state()
+
+    def get_relative_path(self, file_path: str) -> str:
+        return os.path.relpath(file_path, self.folder)
+
+    def get_files(self, patient: int) -> Tuple[str, str]:
+        """
+        The paths of the reference and the test file of a patient (first patient: 1).
+        """
+        entry = self.get_entry(patient=patient)
+
+        return os.path.join(self.folder, entry["ref"]), os.path.join(self.folder, entry["test"])
+
+    def get_entry(self, patient: int) -> dict:
+        """
+        The entry of a patient (first patient: 1).
+        """
+        if patient not in self.patients:
+            raise ValueError("Unknown patient: %s (available: %s, the patients are numbered from 1)"
+                             % (patient, "1-%d" % len(self.patients) if len(self.patients) > 0 else "none"))
+
+        return self.patients[patient]
+
+    def get_labels(self) -> Tuple[list, list]:
+        """
+        The paths of the reference and the test files of all the patients, in the order of the patients.
+        """
+        files = [self.get_files(patient=patient) for patient in sorted(self.patients)]
+
+        return [f for f, _ in files], [f for _, f in files]
+
+    def verify(self, patient: int) -> list:
+        """
+        Compares the checksums of the files of a patient with the manifest.
+
+        Returns:
+            changed: the paths of the changed files
+        """
+        entry = self.get_entry(patient=patient)
+        changed = []
+        for file_path, key in zip(self.get_files(patient=patient), ("ref_sha256", "test_sha256")):
+            if key in entry and find_checksum(file_path=file_path) != entry[key]:
+                changed.append(file_path)
+
+        return changed
+
+
+def read_shape(file_path: str) -> list:
+    """
+    Reads the shape of a volume from the header of the file, in the order of the array axes.
+    """
+    reader = SITK.ImageFileReader()
+    reader.SetFileName(file_path)
+    reader.ReadImageInformation()
+
+    return list(reader.GetSize()[::-1])
+
+
+def find_checksum(file_path: str) -> str:
+    """
+    Calculates the SHA-256 checksum of a file.
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
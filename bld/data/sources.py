@@ -0,0 +1,98 @@
+from abc import ABC, abstractmethod
+import os
+import shutil
+from typing import Union
+from urllib.parse import unquote, urlparse
+from urllib.request import url2pathname
+
+import gdown
+
+
+class DataSource(ABC):
+    """
+    The source of a mask archive (or a folder of masks), used by the DataDownloader.
+    The subclasses define how the data is fetched (fetch), the folder sources list their files as well.
+
+    Args:
+        location: the URL or the path of the data
+
+    Returns:
+        is_folder: True if the source is a folder of mask files instead of an archive
+    """
+
+    is_folder = False
+
+    def __init__(self, location: str):
+        self.location = location
+
+    @abstractmethod
+    def fetch(self, destination: str):
+        """
+        Fetches the archive to the destination path. A partial download is resumed,
+        the destination only appears when the download is complete.
+        """
+
+    def list_files(self) -> list:
+        """
+        The paths of the mask files of a folder source (an archive source has no files to list).
+        """
+        return []
+
+
+class GoogleDriveSource(DataSource):
+    """
+    An archive shared on Google Drive, downloaded by gdown (partial downloads are resumed).
+    """
+
+    def fetch(self, destination: str):
+        gdown.download(url=self.location, output=destination, quiet=False, resume=True)
+
+
+class LocalSource(DataSource):
+    """
+    An archive or a folder of masks on the local (or mounted) file system, given by a path or a file:// URL.
+    It can replace the remote sources, e.g. for tests or for data which is already on shared storage.
+    """
+
+    def __init__(self, location: str):
+        super().__init__(location=location)
+        self.path = to_local_path(location=location)
+        self.is_folder = os.path.isdir(self.path)
+
+    def fetch(self, destination: str):
+        # the copy continues from the end of the partial file
+        partial = destination + ".part"
+        start = os.path.getsize(partial) if os.path.exists(partial) else 0
+        if start > os.path.getsize(self.path):
+            start = 0
+        with open(self.path, 'rb') as source, open(partial, 'ab' if start > 0 else 'wb') as target:
+            source.seek(start)
+            shutil.copyfileobj(source, target, length=2 ** 20)
+        os.replace(partial, destination)
+
+    def list_files(self) -> list:
+        return sorted(entry.path for entry in os.scandir(self.path) if entry.is_file())
+
+
+def to_local_path(location: str) -> str:
+    """
+    Converts a file:// URL to a path, other locations are returned unchanged.
+    """
+    if location.startswith("file://"):
+        parsed = urlparse(location)
+        return url2pathname(unquote(parsed.netloc + parsed.path))
+
+    return location
+
+
+def create_source(location: Union[str, DataSource]) -> DataSource:
+    """
+    Creates the source of a location: file:// URLs and existing paths are local sources,
+    other URLs are downloaded from Google Drive. DataSource objects are returned unchanged.
+    """
+    if isinstance(location, DataSource):
+        return location
+    if location.startswith("file://") or os.path.exists(location):
+        return LocalSource(location=location)
+
+    return GoogleDriveSource(location=location)
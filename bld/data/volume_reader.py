@@ -0,0 +1,140 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+import SimpleITK as SITK
+
+
+class VolumeReader:
+    """
+    Reads the mask volumes of the patients, so that each file is only read (and decompressed) once.
+
+    The arrays of the last read files are kept in memory and shared by the users
+    (e.g. the contour extraction and the masks of the DataLoader).
+    If a cache folder is given, each file is converted once to an uncompressed .npy file,
+    which is opened as a read-only memory-mapped array later, so repeated passes
+    over a cohort do not decompress the files again.
+
+    Args:
+        cache_folder: the folder of the uncompressed volumes (None: no cache on the disk)
+        max_volumes: the number of volumes kept in memory (2: the reference and the test volume of a patient)
+
+    Returns:
+        hits: the number of volumes found in the memory or in the cache folder
+        misses: the number of volumes read from the original files
+    """
+
+    version = 1
+
+    def __init__(self, cache_folder: Optional[str] = None, max_volumes: Optional[int] = 2):
+        self.cache_folder = cache_folder
+        self.max_volumes = max_volumes
+
+        self.volumes: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+        if self.cache_folder is not None:
+            os.makedirs(self.cache_folder, exist_ok=True)
+
+    def __getstate__(self) -> dict:
+        # the volumes in memory are not sent to the worker processes
+        state = self.__dict__.copy()
+        state['volumes'] = OrderedDict()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def read(self, file_path: str) -> np.ndarray:
+        """
+        Reads the volume of a mask file (slices along the first axis).
+        The returned array must not be modified, it is shared (and it is read-only, if it is memory-mapped).
+        """
+        key = os.path.abspath(file_path)
+        with self.lock:
+            if key in self.volumes:
+                self.volumes.move_to_end(key)
+                self.hits += 1
+                return self.volumes[key]
+
+        if self.cache_folder is None:
+            volume = read_volume(file_path=file_path)
+            self.misses += 1
+        else:
+            volume = self.read_cached(file_path=file_path)
+
+        with self.lock:
+            self.volumes[key] = volume
+            while len(self.volumes) > max(self.max_volumes, 1):
+                self.volumes.popitem(last=False)
+
+        return volume
+
+    def read_cached(self, file_path: str) -> np.ndarray:
+        """
+        Opens the uncompressed copy of a file as a memory-mapped array, the copy is created at the first call.
+        """
+        path = self.get_path(file_path=file_path)
+        try:
+            volume = np.load(path, mmap_mode='r')
+            self.hits += 1
+            return volume
+        except (OSError, ValueError):
+            pass
+
+        # write to a temporary file first, so that parallel readers never open a partial file
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_folder, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as f:
+            np.save(f, read_volume(file_path=file_path))
+        os.replace(temp_path, path)
+        self.misses += 1
+
+        return np.load(path, mmap_mode='r')
+
+    def get_path(self, file_path: str) -> str:
+        """
+        The path of the uncompressed copy of a file, the name depends on the path, size and modification time.
+        """
+        stat = os.stat(file_path)
+        description = json.dumps({"version": VolumeReader.version, "path": os.path.abspath(file_path),
+                                  "size": stat.st_size, "mtime": stat.st_mtime_ns}, sort_keys=True)
+
+        return os.path.join(self.cache_folder, hashlib.sha1(description.encode()).hexdigest() + '.npy')
+
+    @staticmethod
+    def get_spacing(file_path: str) -> Tuple[float, ...]:
+        """
+        Reads the spacing of a volume from the header of the file, in the order of the array axes.
+        """
+        reader = SITK.ImageFileReader()
+        reader.SetFileName(file_path)
+        reader.ReadImageInformation()
+
+        return tuple(reader.GetSpacing()[::-1])
+
+    def clear(self):
+        """
+        Forgets the volumes in memory and deletes the uncompressed copies.
+        """
+        with self.lock:
+            self.volumes.clear()
+        if self.cache_folder is not None:
+            for entry in os.scandir(self.cache_folder):
+                if entry.name.endswith('.npy'):
+                    os.remove(entry.path)
+
+
+def read_volume(file_path: str) -> np.ndarray:
+    """
+    Reads a mask file with SimpleITK to a numpy array (slices along the first axis).
+    """
+    return SITK.GetArrayFromImage(image=SITK.ReadImage(fileName=file_path))
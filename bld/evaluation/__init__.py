@@ -1,3 +1,5 @@
 from .analysis import calculate_ldp, calculate_bld_distribution
 from .metrics_evaluator import MetricsEvaluator
-from .traditional_metrics import TraditionalMetricsCalculator
+from .traditional_metrics import TraditionalMetricsCalculator, VolumeOverlapCalculator
+from .metrics_results import MetricsResults
+from .cohort_evaluator import CohortEvaluator
@@ -0,0 +1,172 @@
+from concurrent.futures import as_completed
+import time
+from typing import Callable, Optional, List, Tuple
+
+import pandas as pd
+
+from bld.data import ContourCache, DataDownloader, VolumeReader
+from bld.evaluation.metrics_evaluator import MetricsEvaluator, create_executor, run_profiled
+from bld.evaluation.metrics_results import MetricsResults
+from bld.metrics import ContourResampler
+from bld.utils.profiling import Profiler
+
+
+class CohortEvaluator:
+    """
+    Calculates the metrics for all the image slices of several patients.
+    The patients are evaluated in parallel by worker processes,
+    the results are collected into one table as the patients are finished.
+
+    Args:
+        data_downloader: DataDownloader
+        patients: the patient numbers (None: all the patients of the data folder)
+        il: inside penalty level value
+        ol: outside penalty level value
+        engine: the BLD engine of the MSICalculator ('dense', 'kdtree' or 'tiled')
+        pairing: the contour pairing of the MSICalculator ('greedy' or 'one_to_one')
+        executor: how the patients are evaluated: 'serial', 'thread' (thread pool) or 'process' (process pool)
+        max_workers: the number of workers of the pool (None: the default of concurrent.futures)
+        contour_cache: the on-disk cache of the extracted contours, shared by the workers (None: no cache)
+        volume_reader: reads the volumes, e.g. with a memory-mapped cache folder shared by the workers
+            (None: each file is read once)
+        results_folder: if given, the contour results of each patient are appended to a new file
+            of this folder as soon as the patient is finished (see MetricsResults.append_to)
+        results_format: the format of the result files ('parquet' or 'feather')
+        resampler: if given, the contours are resampled before the BLD calculation (see ContourResampler)
+        memory_budget: the approximate memory of one block of distances in bytes ('tiled' engine)
+        profiler: records the time of the stages of all the patients (each patient is recorded by a child
+            profiler, which is merged when the patient is finished, the slice totals are summed over the patients)
+
+    Returns:
+        results: one row for each evaluated slice with the patient number, the slice index,
+            the median MSI of the contours, and the Dice, Jaccard and Hausdorff values
+        contour_results: the columnar table of all the patients, one row for each contour
+        num_slices: the number of slices of each patient
+        elapsed_time: the wall time of the evaluation in seconds
+        throughput: the number of slices per second and the number of patients per minute
+    """
+
+    columns = ['patient', 'index', 'MSI', 'Dice', 'Jaccard', 'Hausdorff']
+
+    def __init__(self, data_downloader: DataDownloader,
+                 patients: Optional[List[int]] = None,
+                 il: Optional[float] = 1, ol: Optional[float] = 1,
+                 engine: Optional[str] = "dense", pairing: Optional[str] = "greedy",
+                 executor: Optional[str] = "process", max_workers: Optional[int] = None,
+                 contour_cache: Optional[ContourCache] = None,
+                 volume_reader: Optional[VolumeReader] = None,
+                 results_folder: Optional[str] = None, results_format: Optional[str] = "parquet",
+                 resampler: Optional[ContourResampler] = None, memory_budget: Optional[int] = 2 ** 26,
+                 profiler: Optional[Profiler] = None):
+        if executor not in MetricsEvaluator.executors:
+            raise ValueError("Unknown executor: %s (available: %s)" % (executor, ", ".join(MetricsEvaluator.executors)))
+
+        self.data_downloader = data_downloader
+        # the manifest is checked once for the cohort, the workers get the refreshed manifest
+        data_downloader.refresh_manifest()
+        if patients is None:
+            labels_ref, _ = data_downloader.get_labels()
+            patients = list(range(1, len(labels_ref) + 1))
+        self.patients = patients
+
+        self.il = il
+        self.ol = ol
+        self.engine = engine
+        self.pairing = pairing
+        self.executor = executor
+        self.max_workers = max_workers
+        self.contour_cache = contour_cache
+        self.volume_reader = volume_reader
+        self.results_folder = results_folder
+        self.results_format = results_format
+        self.resampler = resampler
+        self.memory_budget = memory_budget
+        self.profiler = Profiler(enabled=False) if profiler is None else profiler
+
+        self.results: pd.DataFrame = pd.DataFrame()
+        self.contour_results = MetricsResults()
+        self.num_slices: dict = dict()
+        self.elapsed_time: float = 0
+        self.throughput: dict = dict()
+
+    def run(self, callback: Optional[Callable[[int, pd.DataFrame], None]] = None):
+        """
+        Evaluate all the patients.
+
+        Args:
+            callback: called with the patient number and the table of the patient,
+                as soon as the evaluation of the patient is finished
+        """
+        start = time.perf_counter()
+        tables = []
+        self.contour_results = MetricsResults()
+
+        def collect(patient: int, patient_results: MetricsResults, num_slices: int,
+                    patient_profiler: Optional[Profiler] = None):
+            self.profiler.merge(patient_profiler)
+            table = patient_results.find_slice_medians()
+            tables.append(table)
+            self.contour_results.extend(patient_results)
+            self.num_slices[patient] = num_slices
+            if self.results_folder is not None:
+                patient_results.append_to(folder=self.results_folder, file_format=self.results_format)
+            if callback is not None:
+                callback(patient, table)
+
+        pool = create_executor(executor=self.executor, max_workers=self.max_workers)
+        if pool is None:
+            for patient in self.patients:
+                collect(patient, *self.evaluate_one_patient(patient=patient))
+        else:
+            with pool:
+                futures = {
+                    pool.submit(run_profiled, evaluate_patient, self.profiler.child(), patient,
+                                self.data_downloader, self.il, self.ol, self.engine, self.pairing,
+                                self.contour_cache, self.volume_reader, self.resampler,
+                                self.memory_budget): patient
+                    for patient in self.patients
+                }
+                for future in as_completed(futures):
+                    (patient_results, num_slices), patient_profiler = future.result()
+                    collect(futures[future], patient_results, num_slices, patient_profiler)
+
+        self.elapsed_time = time.perf_counter() - start
+        self.results = pd.concat(tables, ignore_index=True) if len(tables) > 0 else pd.DataFrame(
+            columns=CohortEvaluator.columns)
+        self.results = self.results.sort_values(by=['patient', 'index'], ignore_index=True)
+        self.throughput = {
+            "slices_per_second": sum(self.num_slices.values()) / self.elapsed_time,
+            "patients_per_minute": 60 * len(self.num_slices) / self.elapsed_time
+        }
+
+    def evaluate_one_patient(self, patient: int) -> Tuple[MetricsResults, int]:
+        """
+        Calculate the metrics of one patient in the current process.
+        """
+        return evaluate_patient(patient, self.data_downloader, self.il, self.ol, self.engine, self.pairing,
+                                self.contour_cache, self.volume_reader, self.resampler, self.memory_budget,
+                                profiler=self.profiler)
+
+
+def evaluate_patient(patient: int, data_downloader: DataDownloader,
+                     il: float, ol: float, engine: str, pairing: str,
+                     contour_cache: Optional[ContourCache] = None,
+                     volume_reader: Optional[VolumeReader] = None,
+                     resampler: Optional[ContourResampler] = None,
+                     memory_budget: Optional[int] = 2 ** 26,
+                     profiler: Optional[Profiler] = None) -> Tuple[MetricsResults, int]:
+    """
+    Calculate the metrics for all image slices of one patient.
+    It is a module level function, so that the patients can be sent to worker processes.
+
+    Returns:
+        results: the columnar table of the patient, one row for each contour of the evaluated slices
+        num_slices: the number of slices of the patient
+    """
+    evaluator = MetricsEvaluator(patient=patient, data_downloader=data_downloader,
+                                 il=il, ol=ol, engine=engine, pairing=pairing, contour_cache=contour_cache,
+                                 volume_reader=volume_reader, resampler=resampler,
+                                 memory_budget=memory_budget, profiler=profiler)
+    evaluator.evaluate()
+
+    return evaluator.results, evaluator.num_slices
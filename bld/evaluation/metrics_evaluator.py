@@ -1,11 +1,18 @@
-from typing import Optional, List
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from typing import Callable, Optional, List, Tuple
 
 import numpy as np
 
+from bld.data import ContourCache
 from bld.data import DataLoader
 from bld.data import DataDownloader
-from bld.evaluation.traditional_metrics import TraditionalMetricsCalculator
-from bld.metrics import MSICalculator
+from bld.data import VolumeReader
+from bld.evaluation.metrics_results import MetricsResults
+from bld.evaluation.traditional_metrics import TraditionalMetricsCalculator, VolumeOverlapCalculator
+from bld.metrics import ContourResampler, MSICalculator, VolumetricMSICalculator
+from bld.metrics.msi_calculator import find_com
+from bld.utils.profiling import Profiler
 
 
 class MetricsEvaluator:
@@ -17,6 +24,18 @@ class MetricsEvaluator:
         data_downloader: DataDownloader
         il: inside penalty level value
         ol: outside penalty level value
+        engine: the BLD engine of the MSICalculator ('dense', 'kdtree' or 'tiled')
+        pairing: the contour pairing of the MSICalculator ('greedy' or 'one_to_one')
+        executor: how the slices are evaluated: 'serial', 'thread' (thread pool) or 'process' (process pool)
+        max_workers: the number of workers of the pool (None: the default of concurrent.futures)
+        lazy: if True, the DataLoader reads the volumes once and extracts the contours slice by slice
+        contour_cache: the on-disk cache of the extracted contours (None: no cache)
+        volume_reader: reads the volumes of the patient (None: each file is read once by the DataLoader)
+        resampler: if given, the contours are resampled before the BLD calculation (see ContourResampler),
+            the traditional metrics use the original contours
+        memory_budget: the approximate memory of one block of distances in bytes ('tiled' engine)
+        profiler: records the time of the stages of the data loading and of each slice
+            (the slices evaluated by a pool are recorded by child profilers, which are merged in slice order)
 
     Returns:
         dl: the DataLoader class for the selected patient which contains the patient data
@@ -26,17 +45,44 @@ class MetricsEvaluator:
         dice: Dice index values
         jacc: Jaccard index values
         haus: Hausdorff distance values
+        results: the columnar table of the metrics, one row for each contour of the slices in idx
+        sweep_idx: the slice indices of the MSI tensor calculated by sweep
+        fast_path_counts: the number of slices of the last evaluate or sweep which were not evaluated
+            by the full calculation: 'empty' (no reference and test foreground, skipped)
+            and 'identical' (identical reference and test contours, the results are known)
+        volume_msi: the MSI of the whole volume calculated in 3D by evaluate_volume
+        volume_dice: the Dice index of the whole volume
+        volume_jaccard: the Jaccard index of the whole volume
     """
 
+    executors = ("serial", "thread", "process")
+
     def __init__(self, patient: int,
                  data_downloader: DataDownloader,
-                 il: Optional[float] = 1, ol: Optional[float] = 1):
+                 il: Optional[float] = 1, ol: Optional[float] = 1,
+                 engine: Optional[str] = "dense", pairing: Optional[str] = "greedy",
+                 executor: Optional[str] = "serial", max_workers: Optional[int] = None,
+                 lazy: Optional[bool] = False, contour_cache: Optional[ContourCache] = None,
+                 volume_reader: Optional[VolumeReader] = None,
+                 resampler: Optional[ContourResampler] = None, memory_budget: Optional[int] = 2 ** 26,
+                 profiler: Optional[Profiler] = None):
+        if executor not in MetricsEvaluator.executors:
+            raise ValueError("Unknown executor: %s (available: %s)" % (executor, ", ".join(MetricsEvaluator.executors)))
+
         self.patient = patient
 
         self.il = il
         self.ol = ol
+        self.engine = engine
+        self.pairing = pairing
+        self.executor = executor
+        self.max_workers = max_workers
+        self.resampler = resampler
+        self.memory_budget = memory_budget
+        self.profiler = Profiler(enabled=False) if profiler is None else profiler
 
-        self.dl = DataLoader(patient=patient, data_downloader=data_downloader)
+        self.dl = DataLoader(patient=patient, data_downloader=data_downloader, lazy=lazy,
+                             contour_cache=contour_cache, volume_reader=volume_reader, profiler=self.profiler)
         self.folder = self.dl.folder
 
         # Get number of slices available
@@ -50,6 +96,7 @@ class MetricsEvaluator:
         self.dice: list = []
         self.jacc: list = []
         self.haus: list = []
+        self.results = MetricsResults()
 
         self.msi_with_zeros: list = []
         self.dice_all_slices: list = []
@@ -57,6 +104,12 @@ class MetricsEvaluator:
         self.hausdorff_all_slices: list = []
         self.idx_all_slices: list = []
 
+        self.sweep_idx: list = []
+        self.fast_path_counts: dict = {"empty": 0, "identical": 0}
+        self.volume_msi: Optional[float] = None
+        self.volume_dice: Optional[float] = None
+        self.volume_jaccard: Optional[float] = None
+
     @staticmethod
     def check_contours_on_slice(test_points: np.ndarray, ref_points: np.ndarray) -> bool:
         """
@@ -74,74 +127,338 @@ class MetricsEvaluator:
 
         return error
 
-    def find_msi_for_one_slice(self, slice_index: int) -> List:
-        """
-        Calculate MSI and traditional metrics for one image slice.
+    def evaluate(self):
         """
-        slice_name = 'slice' + str(slice_index)
-        # Finding the MSI
-        points_ref = self.dl.c_ref[slice_name]
-        points_test = self.dl.c_test[slice_name]
-        msi_calc = MSICalculator(
-            il=self.il, ol=self.ol,
-            ref_points=points_ref,
-            test_points=points_test)
-        msi_calc.run()
-
-        return msi_calc.msi
+        Calculate the metrics for all image slices.
+        The slices are evaluated by the selected executor, the results are collected in slice order.
+        The Dice and Jaccard indices of all the slices are calculated in one pass over the volumes.
+        If the DataLoader found the bounding boxes, the masks are cropped to the boxes.
 
-    def find_traditional_metrics_for_one_slice(self, slice_index: int) -> TraditionalMetricsCalculator:
+        The slices are classified by the foreground counts of the overlap calculation first:
+        the slices without reference and test foreground are skipped (they have no contours, so they have
+        no results). If the reference and the test foreground is the same, and the contours are identical
+        (see is_identical_slice), the known results are used: MSI = 0 for each contour (all the BLD values are 0),
+        the Dice and Jaccard indices of the slice (1) and Hausdorff distance = 0.
         """
-        Calculate traditional metrics for one image slice (MSI is zero).
-        """
-        slice_name = 'slice' + str(slice_index)
-
-        points_ref = self.dl.c_ref[slice_name]
-        points_test = self.dl.c_test[slice_name]
+        volume_ref, volume_test = self.get_volumes()
+        with self.profiler.stage("volume_overlap", size=volume_ref.size):
+            overlap = VolumeOverlapCalculator(volume_ref=volume_ref, volume_test=volume_test)
+        self.volume_dice = overlap.volume_dice
+        self.volume_jaccard = overlap.volume_jaccard
 
-        trad_metrics_calc = TraditionalMetricsCalculator(
-                                points_ref=points_ref,
-                                points_test=points_test,
-                                slice_mask_ref=self.dl.mask_ref[slice_name],
-                                slice_mask_test=self.dl.mask_test[slice_name])
-
-        return trad_metrics_calc
+        is_empty = (overlap.count_ref == 0) & (overlap.count_test == 0)
+        is_same_foreground = (overlap.count_ref == overlap.count_intersection) & (
+                overlap.count_test == overlap.count_intersection)
+        fast_results = dict()
+        for i in np.flatnonzero(~is_empty & is_same_foreground).tolist():
+            name = 'slice' + str(i)
+            if is_identical_slice(points_ref=self.dl.c_ref[name], points_test=self.dl.c_test[name]):
+                fast_results[i] = ([0.0] * len(self.dl.c_ref[name]), overlap.dice[i], overlap.jaccard[i],
+                                   np.float64(0.0))
+        self.fast_path_counts = {"empty": int(np.count_nonzero(is_empty)), "identical": len(fast_results)}
 
-    def evaluate(self):
-        """
-        Calculate the metrics for all image slices.
-        """
-        for i in range(self.num_slices):
-            points_ref = self.dl.c_ref['slice' + str(i)]
-            points_test = self.dl.c_test['slice' + str(i)]
+        slice_indices = [i for i in np.flatnonzero(~is_empty).tolist() if i not in fast_results]
+        slice_names = ['slice' + str(i) for i in slice_indices]
+        slice_masks = [self.get_slice_masks(slice_index=i) for i in slice_indices]
+        arguments = (
+            repeat(self.il), repeat(self.ol), repeat(self.engine), repeat(self.pairing),
+            [self.dl.c_ref[name] for name in slice_names],
+            [self.dl.c_test[name] for name in slice_names],
+            [mask_ref for mask_ref, _ in slice_masks],
+            [mask_test for _, mask_test in slice_masks],
+            overlap.dice[slice_indices], overlap.jaccard[slice_indices], repeat(self.resampler),
+            repeat(self.memory_budget)
+        )
+        slice_results = dict(zip(slice_indices, self.map_slices(function=evaluate_slice, arguments=arguments,
+                                                                slice_indices=slice_indices)))
+        slice_results.update(fast_results)
 
-            is_run_correctly = self.check_contours_on_slice(
-                test_points=points_test,
-                ref_points=points_ref)
+        for i in sorted(slice_results):
+            m, dice, jaccard, hausdorff = slice_results[i]
+            name = 'slice' + str(i)
+            points_ref = self.dl.c_ref[name]
+            points_test = self.dl.c_test[name]
 
-            if not is_run_correctly:  # there is no error while checking the contours
-                m = self.find_msi_for_one_slice(slice_index=i)
-                t = self.find_traditional_metrics_for_one_slice(slice_index=i)
+            if m is not None:  # there is no error while checking the contours
                 self.msindex.append(m)
                 self.idx.append(i)
-                self.dice.append(t.dice)
-                self.jacc.append(t.jaccard)
-                self.haus.append(t.hausdorff)
+                self.dice.append(dice)
+                self.jacc.append(jaccard)
+                self.haus.append(hausdorff)
+                self.results.append_slice(patient=self.patient, slice_index=i, msi=m,
+                                          dice=dice, jaccard=jaccard, hausdorff=hausdorff)
 
                 self.msi_with_zeros.append(m)
-                self.dice_all_slices.append(t.dice)
-                self.jaccard_all_slices.append(t.jaccard)
-                self.hausdorff_all_slices.append(t.hausdorff)
+                self.dice_all_slices.append(dice)
+                self.jaccard_all_slices.append(jaccard)
+                self.hausdorff_all_slices.append(hausdorff)
                 self.idx_all_slices.append(i)
 
             else:  # there was some kind of error while checking the contours (empty slice or incorrect pairing)
                 # we still want to have the slice with traditional metrics and MSI=0
-                t_2 = self.find_traditional_metrics_for_one_slice(slice_index=i)
                 if len(points_ref) != 0 and len(points_test) != 0:  # there is at least one ref and one test point
                     # if there is only ref or only test contour, then all metrics will equal to zero/inf
                     # --> not interesting
                     self.msi_with_zeros.append(0)
-                    self.dice_all_slices.append(t_2.dice)
-                    self.jaccard_all_slices.append(t_2.jaccard)
-                    self.hausdorff_all_slices.append(t_2.hausdorff)
+                    self.dice_all_slices.append(dice)
+                    self.jaccard_all_slices.append(jaccard)
+                    self.hausdorff_all_slices.append(hausdorff)
                     self.idx_all_slices.append(i)
+
+    def sweep(self, il_values: List[float], ol_values: List[float]) -> np.ndarray:
+        """
+        Calculate MSI for all the slices and all the combinations of the penalty levels.
+        The BLD values are calculated once for each contour pair (with the selected executor),
+        then the MSI values of the whole grid are calculated in one vectorized pass.
+
+        Args:
+            il_values: the inside penalty levels
+            ol_values: the outside penalty levels
+
+        Returns:
+            msi: numpy array of shape (number of slices, number of contours, number of il values,
+                number of ol values), the slices are listed in sweep_idx
+                (the slices where the MSI can be calculated), missing contours are NaN
+        """
+        # the slices without contours are skipped, the BLD values of the slices with identical contours are all 0
+        slice_indices = []
+        fast_results = dict()
+        for i in self.get_slice_indices():
+            name = 'slice' + str(i)
+            points_ref = self.dl.c_ref[name]
+            points_test = self.dl.c_test[name]
+            if len(points_ref) == 0 and len(points_test) == 0:
+                continue
+            if is_identical_slice(points_ref=points_ref, points_test=points_test):
+                fast_results[i] = [np.zeros((r.shape[1],)) for r in points_ref]
+            else:
+                slice_indices.append(i)
+        self.fast_path_counts = {"empty": self.num_slices - len(slice_indices) - len(fast_results),
+                                 "identical": len(fast_results)}
+
+        slice_names = ['slice' + str(i) for i in slice_indices]
+        arguments = (
+            repeat(self.engine), repeat(self.pairing),
+            [self.dl.c_ref[name] for name in slice_names],
+            [self.dl.c_test[name] for name in slice_names],
+            repeat(self.resampler), repeat(self.memory_budget)
+        )
+        slice_results = dict(zip(slice_indices, self.map_slices(function=find_final_bld_for_slice,
+                                                                arguments=arguments, slice_indices=slice_indices)))
+        slice_results.update(fast_results)
+
+        self.sweep_idx = [i for i in sorted(slice_results) if slice_results[i] is not None]
+        final_blds = [slice_results[i] for i in self.sweep_idx]
+
+        with self.profiler.stage("msi_grid", size=sum(len(slice_bld) for slice_bld in final_blds)):
+            grid = MSICalculator.calculate_msi_grid(
+                final_blds=[contour_bld for slice_bld in final_blds for contour_bld in slice_bld],
+                il_values=il_values, ol_values=ol_values)
+
+        max_contours = max([len(slice_bld) for slice_bld in final_blds], default=0)
+        msi = np.full((len(final_blds), max_contours, grid.shape[1], grid.shape[2]), np.nan)
+        start = 0
+        for i, slice_bld in enumerate(final_blds):
+            msi[i, :len(slice_bld)] = grid[start:start + len(slice_bld)]
+            start += len(slice_bld)
+
+        return msi
+
+    def evaluate_volume(self) -> float:
+        """
+        Calculate the MSI of the whole volume in 3D, from the surfaces of the masks
+        in physical coordinates (using the spacing of the reference image).
+        """
+        file_ref = self.dl.file_ref
+        file_test = self.dl.file_test
+
+        msi_calc = VolumetricMSICalculator(
+            il=self.il, ol=self.ol,
+            mask_ref=self.dl.read_volume(file_path=file_ref)[:self.num_slices],
+            mask_test=self.dl.read_volume(file_path=file_test)[:self.num_slices],
+            spacing=VolumeReader.get_spacing(file_path=file_ref))
+        with self.profiler.stage("volume_msi", size=msi_calc.ref_points.shape[1]):
+            msi_calc.run()
+        self.volume_msi = msi_calc.msi
+
+        return self.volume_msi
+
+    def get_slice_indices(self) -> List[int]:
+        """
+        The indices of the slices to evaluate, the empty slices are left out if the bounding boxes are known.
+        """
+        if self.dl.bounding_boxes is None:
+            return list(range(self.num_slices))
+
+        return np.flatnonzero(~self.dl.bounding_boxes.is_empty[:self.num_slices]).tolist()
+
+    def get_slice_masks(self, slice_index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The reference and the test mask of a slice (cropped to the bounding box of the slice, if it is known).
+        """
+        slice_name = 'slice' + str(slice_index)
+        mask_ref = self.dl.mask_ref[slice_name]
+        mask_test = self.dl.mask_test[slice_name]
+        if self.dl.bounding_boxes is None:
+            return mask_ref, mask_test
+
+        return (self.dl.bounding_boxes.crop(image_slice=mask_ref, slice_index=slice_index),
+                self.dl.bounding_boxes.crop(image_slice=mask_test, slice_index=slice_index))
+
+    def get_volumes(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The reference and the test volume of the evaluated slices
+        (cropped to the bounding box of all the slices, if it is known).
+        """
+        if self.dl.bounding_boxes is None:
+            return self.dl.volume_ref[:self.num_slices], self.dl.volume_test[:self.num_slices]
+
+        return (self.dl.bounding_boxes.crop_volume(volume=self.dl.volume_ref)[:self.num_slices],
+                self.dl.bounding_boxes.crop_volume(volume=self.dl.volume_test)[:self.num_slices])
+
+    def map_slices(self, function: Callable, arguments: tuple, slice_indices: List[int]) -> list:
+        """
+        Calls the function for each slice with the selected executor, the results are in the order of the slices.
+        If the profiler is enabled, each slice is recorded by a child profiler, which is passed to the function
+        and merged into the profiler of the evaluator after the slice is finished.
+        """
+        if self.profiler.enabled:
+            profilers = [self.profiler.child(slice_index=i) for i in slice_indices]
+            arguments = (repeat(function), profilers) + tuple(arguments)
+            function = run_profiled
+
+        pool = create_executor(executor=self.executor, max_workers=self.max_workers)
+        if pool is None:
+            results = list(map(function, *arguments))
+        else:
+            with pool:
+                results = list(pool.map(function, *arguments))
+
+        if self.profiler.enabled:
+            # the profilers may be the copies filled by worker processes
+            for _, slice_profiler in results:
+                self.profiler.merge(slice_profiler)
+            results = [result for result, _ in results]
+
+        return results
+
+
+def run_profiled(function: Callable, profiler: Profiler, *arguments) -> tuple:
+    """
+    Calls the function with a profiler, and returns the profiler with the result
+    (so the records of a worker process are sent back to the caller).
+    """
+    return function(*arguments, profiler=profiler), profiler
+
+
+def is_identical_slice(points_ref: list, points_test: list) -> bool:
+    """
+    Checks if the reference and the test contours of a slice are identical, and their pairing is the identity
+    (the contours can be evaluated, and their COMs are all different). Then each BLD value is 0,
+    so the MSI of each contour is 0 and the Hausdorff distance is 0.
+    """
+    if MetricsEvaluator.check_contours_on_slice(test_points=points_test, ref_points=points_ref):
+        return False
+    if not all(np.array_equal(r, t) for r, t in zip(points_ref, points_test)):
+        return False
+    coms = np.array([find_com(c) for c in points_ref])
+
+    return len(np.unique(coms, axis=0)) == len(coms)
+
+
+def create_executor(executor: str, max_workers: Optional[int] = None) -> Optional[Executor]:
+    """
+    Creates the pool for the parallel evaluation ('thread' or 'process'), None for serial evaluation.
+    """
+    if executor == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers)
+    if executor == "process":
+        return ProcessPoolExecutor(max_workers=max_workers)
+
+    return None
+
+
+def evaluate_slice(il: float, ol: float, engine: str, pairing: str,
+                   points_ref: list, points_test: list,
+                   slice_mask_ref: np.ndarray, slice_mask_test: np.ndarray,
+                   dice: Optional[float] = None,
+                   jaccard: Optional[float] = None,
+                   resampler: Optional[ContourResampler] = None,
+                   memory_budget: Optional[int] = 2 ** 26,
+                   profiler: Optional[Profiler] = None) -> Tuple[Optional[List], float, float, float]:
+    """
+    Calculate MSI and traditional metrics for one image slice.
+    It is a module level function, so that the slices can be sent to worker processes.
+    The Dice and Jaccard indices are only calculated, if they are not given.
+    The contours are resampled for the MSI by the resampler (if given).
+    The stages are recorded by the profiler (if given).
+
+    Returns:
+        msi: the MSI values of the contours (None if the contours of the slice are not compatible)
+        dice: Dice index value
+        jaccard: Jaccard index value
+        hausdorff: Hausdorff distance value
+    """
+    is_run_correctly = MetricsEvaluator.check_contours_on_slice(
+        test_points=points_test,
+        ref_points=points_ref)
+
+    profiler = Profiler(enabled=False) if profiler is None else profiler
+
+    msi = None
+    if not is_run_correctly:  # there is no error while checking the contours
+        msi_calc = MSICalculator(
+            il=il, ol=ol,
+            ref_points=points_ref,
+            test_points=points_test,
+            engine=engine,
+            pairing=pairing,
+            resampler=resampler,
+            memory_budget=memory_budget,
+            profiler=profiler)
+        msi_calc.run()
+        msi = msi_calc.msi
+
+    with profiler.stage("traditional_metrics", size=sum(c.size // 2 for c in points_ref)):
+        trad_metrics_calc = TraditionalMetricsCalculator(
+            points_ref=points_ref,
+            points_test=points_test,
+            slice_mask_ref=slice_mask_ref,
+            slice_mask_test=slice_mask_test,
+            dice=dice, jaccard=jaccard)
+
+    return msi, trad_metrics_calc.dice, trad_metrics_calc.jaccard, trad_metrics_calc.hausdorff
+
+
+def find_final_bld_for_slice(engine: str, pairing: str, points_ref: list, points_test: list,
+                             resampler: Optional[ContourResampler] = None,
+                             memory_budget: Optional[int] = 2 ** 26,
+                             profiler: Optional[Profiler] = None) -> Optional[List]:
+    """
+    Calculate the final BLD values of the contours of one image slice.
+    It is a module level function, so that the slices can be sent to worker processes.
+    The contours are resampled by the resampler (if given).
+    The stages are recorded by the profiler (if given).
+
+    Returns:
+        final_bld: the final BLD values of the contours (None if the contours of the slice are not compatible)
+    """
+    is_run_correctly = MetricsEvaluator.check_contours_on_slice(
+        test_points=points_test,
+        ref_points=points_ref)
+    if is_run_correctly:
+        return None
+
+    # the penalty levels are not used for the BLD
+    msi_calc = MSICalculator(
+        il=1, ol=1,
+        ref_points=points_ref,
+        test_points=points_test,
+        engine=engine,
+        pairing=pairing,
+        resampler=resampler,
+        memory_budget=memory_budget,
+        profiler=profiler)
+    msi_calc.run_bld()
+
+    return msi_calc.final_bld
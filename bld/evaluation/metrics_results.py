@@ -0,0 +1,183 @@
+import glob
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+class MetricsResults:
+    """
+    Stores the metrics in typed columns, one row for each contour of each evaluated slice.
+
+    The slice level metrics (Dice, Jaccard and Hausdorff) are repeated in the rows of the contours of the slice.
+    The rows are appended slice by slice, the columns are concatenated only when they are used.
+    The table can be exported to pandas without copying, and it can be appended to a folder of
+    Parquet or Feather files (one file for each append, this needs pyarrow).
+
+    Returns:
+        columns: the names and the types of the columns (patient, slice, contour, msi, dice, jaccard, hausdorff),
+            get_column returns the numpy array of a column
+    """
+
+    columns = {
+        "patient": np.int64,
+        "slice": np.int64,
+        "contour": np.int64,
+        "msi": np.float64,
+        "dice": np.float64,
+        "jaccard": np.float64,
+        "hausdorff": np.float64
+    }
+    formats = ("parquet", "feather")
+
+    def __init__(self):
+        self.chunks: dict = {name: [] for name in MetricsResults.columns}
+        self.arrays: dict = {name: np.zeros((0,), dtype=dtype) for name, dtype in MetricsResults.columns.items()}
+
+    def __len__(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks["patient"]) + len(self.arrays["patient"])
+
+    def get_column(self, name: str) -> np.ndarray:
+        """
+        The numpy array of a column (the appended chunks are concatenated at the first access).
+        """
+        if len(self.chunks[name]) > 0:
+            self.arrays[name] = np.concatenate([self.arrays[name]] + self.chunks[name]).astype(
+                MetricsResults.columns[name], copy=False)
+            self.chunks[name] = []
+
+        return self.arrays[name]
+
+    def append_slice(self, patient: int, slice_index: int, msi: list,
+                     dice: float, jaccard: float, hausdorff: float):
+        """
+        Appends the rows of the contours of one slice.
+
+        Args:
+            patient: patient number
+            slice_index: the index of the slice
+            msi: the MSI values of the contours of the slice
+            dice: Dice index of the slice
+            jaccard: Jaccard index of the slice
+            hausdorff: Hausdorff distance of the slice
+        """
+        number_of_contours = len(msi)
+        values = {
+            "patient": np.full((number_of_contours,), patient),
+            "slice": np.full((number_of_contours,), slice_index),
+            "contour": np.arange(number_of_contours),
+            "msi": np.asarray(msi, dtype=np.float64),
+            "dice": np.full((number_of_contours,), dice, dtype=np.float64),
+            "jaccard": np.full((number_of_contours,), jaccard, dtype=np.float64),
+            "hausdorff": np.full((number_of_contours,), hausdorff, dtype=np.float64)
+        }
+        for name, value in values.items():
+            self.chunks[name].append(value)
+
+    def extend(self, other: 'MetricsResults'):
+        """
+        Appends all the rows of another result table.
+        """
+        for name in MetricsResults.columns:
+            self.chunks[name].append(other.get_column(name=name))
+
+    def to_pandas(self) -> pd.DataFrame:
+        """
+        Converts the table to a pandas DataFrame, the columns share the memory of the numpy arrays.
+        """
+        return pd.DataFrame({name: self.get_column(name=name) for name in MetricsResults.columns}, copy=False)
+
+    def find_slice_medians(self) -> pd.DataFrame:
+        """
+        Aggregates the contours of each slice: the median MSI and the metrics of the slice,
+        one row for each slice (in the order of the patients and the slices).
+        """
+        patient = self.get_column(name="patient")
+        slice_index = self.get_column(name="slice")
+        msi = self.get_column(name="msi")
+
+        # sort by slice, then by MSI, the medians are the middle elements of the groups
+        order = np.lexsort((msi, slice_index, patient))
+        is_first = np.ones((len(order),), dtype=bool)
+        is_first[1:] = (np.diff(patient[order]) != 0) | (np.diff(slice_index[order]) != 0)
+        starts = np.flatnonzero(is_first)
+        lengths = np.diff(np.append(starts, len(order)))
+        sorted_msi = msi[order]
+        lower = sorted_msi[starts + (lengths - 1) // 2]
+        upper = sorted_msi[starts + lengths // 2]
+        first_rows = order[starts]
+
+        return pd.DataFrame({
+            "patient": patient[first_rows],
+            "index": slice_index[first_rows],
+            "MSI": np.where(lengths % 2 == 1, lower, (lower + upper) / 2),
+            "Dice": self.get_column(name="dice")[first_rows],
+            "Jaccard": self.get_column(name="jaccard")[first_rows],
+            "Hausdorff": self.get_column(name="hausdorff")[first_rows]
+        }, copy=False)
+
+    def append_to(self, folder: str, file_format: Optional[str] = "parquet") -> str:
+        """
+        Writes the rows to a new file in a folder, the folder can be read with read_from (or with pandas).
+
+        Args:
+            folder: the folder of the result files
+            file_format: 'parquet' or 'feather'
+
+        Returns:
+            path: the path of the new file
+        """
+        pyarrow, file_io = import_pyarrow(file_format=file_format)
+        os.makedirs(folder, exist_ok=True)
+        number = len(glob.glob(os.path.join(folder, "part-*." + file_format)))
+        while True:
+            path = os.path.join(folder, "part-%05d.%s" % (number, file_format))
+            try:
+                # exclusive creation, so that parallel writers do not overwrite each other's files
+                with open(path, 'xb'):
+                    break
+            except FileExistsError:
+                number += 1
+
+        table = pyarrow.table({name: self.get_column(name=name) for name in MetricsResults.columns})
+        if file_format == "parquet":
+            file_io.write_table(table, path)
+        else:
+            file_io.write_feather(table, path)
+
+        return path
+
+    @staticmethod
+    def read_from(folder: str, file_format: Optional[str] = "parquet") -> 'MetricsResults':
+        """
+        Reads all the result files of a folder (written by append_to).
+        """
+        _, file_io = import_pyarrow(file_format=file_format)
+
+        results = MetricsResults()
+        for path in sorted(glob.glob(os.path.join(folder, "part-*." + file_format))):
+            table = file_io.read_table(path)
+            for name in MetricsResults.columns:
+                results.chunks[name].append(table.column(name).to_numpy())
+
+        return results
+
+
+def import_pyarrow(file_format: str):
+    """
+    Imports pyarrow (an optional dependency) and its module of the file format (pyarrow.parquet or pyarrow.feather).
+    """
+    if file_format not in MetricsResults.formats:
+        raise ValueError("Unknown file format: %s (available: %s)" % (file_format, ", ".join(MetricsResults.formats)))
+    try:
+        import pyarrow
+        if file_format == "parquet":
+            import pyarrow.parquet as file_io
+        else:
+            import pyarrow.feather as file_io
+    except ImportError as error:
+        raise ImportError("Writing and reading %s files requires pyarrow (pip install pyarrow)" % file_format) \
+            from error
+
+    return pyarrow, file_io
@@ -1,4 +1,8 @@
+from typing import List, Optional, Tuple
+
 import numpy as np
+from scipy.ndimage import distance_transform_edt
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 
 
@@ -6,29 +10,52 @@ class TraditionalMetricsCalculator:
     """
     Calculate the traditional metrics for a selected slice.
 
+    The distances are calculated between the points of the contour pairs (the contours are paired in order).
+    The nearest point distances of all the pairs are found in one pass by the selected method:
+    'kdtree' (one k-d tree query for all the pairs), 'edt' (Euclidean distance transform
+    of the bounding box of each pair) or 'cdist' (the full table of distances of each pair).
+    The methods give the same values.
+
     Args:
         slice_mask_ref: the reference mask of the current slice (all slice, not just one contour)
         slice_mask_test: the test mask of the current slice (all slice, not just one contour)
+        hausdorff_method: the method of the Hausdorff distance ('kdtree', 'edt' or 'cdist')
+        dice: the Dice index of the slice, if it is already known (e.g. from VolumeOverlapCalculator)
+        jaccard: the Jaccard index of the slice, if it is already known
 
     Returns:
         dice: Dice index value
         jaccard: Jaccard index value
         Hausdorff: Hausdorff distance value
+        hausdorff_95: the 95th percentile of the nearest point distances of both directions
+        average_surface_distance: the mean of the nearest point distances of both directions
     """
 
+    hausdorff_methods = ("kdtree", "edt", "cdist")
+
     def __init__(self,
                  points_test: np.ndarray[int],
                  points_ref: np.ndarray[int],
                  slice_mask_ref: np.ndarray[int],
-                 slice_mask_test: np.ndarray[int]):
+                 slice_mask_test: np.ndarray[int],
+                 hausdorff_method: Optional[str] = "kdtree",
+                 dice: Optional[float] = None, jaccard: Optional[float] = None):
+        if hausdorff_method not in TraditionalMetricsCalculator.hausdorff_methods:
+            raise ValueError("Unknown Hausdorff method: %s (available: %s)"
+                             % (hausdorff_method, ", ".join(TraditionalMetricsCalculator.hausdorff_methods)))
+
         self.slice_mask_r = slice_mask_ref
         self.slice_mask_t = slice_mask_test
 
         self.points_ref = points_ref
         self.points_test = points_test
+        self.hausdorff_method = hausdorff_method
+
+        self.hausdorff_95: float = np.inf
+        self.average_surface_distance: float = np.inf
 
-        self.dice = self.find_dice()
-        self.jaccard = self.find_jaccard()
+        self.dice = self.find_dice() if dice is None else dice
+        self.jaccard = self.find_jaccard() if jaccard is None else jaccard
         self.hausdorff = self.find_max_hausdorff()
 
     def find_jaccard(self) -> float:
@@ -36,11 +63,11 @@ class TraditionalMetricsCalculator:
         Calculates Jaccard index on a mask of one slice.
         """
         if self.slice_mask_r.any() and self.slice_mask_t.any():
-            binary_array1 = np.where(self.slice_mask_r != 0, 1, 0)
-            binary_array2 = np.where(self.slice_mask_t != 0, 1, 0)
-            intersection = np.logical_and(binary_array1, binary_array2)
-            union = np.logical_or(binary_array1, binary_array2)
-            jaccard_index = np.sum(intersection) / np.sum(union)
+            binary_array1 = self.slice_mask_r != 0
+            binary_array2 = self.slice_mask_t != 0
+            intersection = np.count_nonzero(binary_array1 & binary_array2)
+            union = np.count_nonzero(binary_array1 | binary_array2)
+            jaccard_index = np.int64(intersection) / np.int64(union)
         else:
             jaccard_index = 0
 
@@ -51,10 +78,11 @@ class TraditionalMetricsCalculator:
         Calculates Dice index on a mask of one slice.
         """
         if self.slice_mask_r.any() and self.slice_mask_t.any():
-            binary_array1 = np.where(self.slice_mask_r != 0, 1, 0)
-            binary_array2 = np.where(self.slice_mask_t != 0, 1, 0)
-            intersection = np.logical_and(binary_array1, binary_array2)
-            dice_index = 2 * np.sum(intersection) / (np.sum(binary_array1) + np.sum(binary_array2))
+            binary_array1 = self.slice_mask_r != 0
+            binary_array2 = self.slice_mask_t != 0
+            intersection = np.count_nonzero(binary_array1 & binary_array2)
+            dice_index = 2 * np.int64(intersection) / np.int64(
+                np.count_nonzero(binary_array1) + np.count_nonzero(binary_array2))
         else:
             dice_index = 0
 
@@ -78,16 +106,140 @@ class TraditionalMetricsCalculator:
     def find_max_hausdorff(self) -> float:
         """
         Calculates Hausdorff distance on a mask of one slice as the maximum of Hausdorff distances
-        of individual contours.
+        of individual contours. The HD95 and the average surface distance are calculated
+        from the same nearest point distances.
         """
-        distances = []
-        for r, t in zip(self.points_ref, self.points_test):
-            if len(self.points_ref) > 0 and len(self.points_test) > 0:
-                distances.append(self.find_hausdorff(coords1=r.T.reshape(-1, 2), coords2=t.T.reshape(-1, 2)))
-                # reshape (2,) to 2D array for the cdist
-        if len(distances) > 0:
-            max_hausdorff = max(distances)
+        pairs = [(r.T.reshape(-1, 2), t.T.reshape(-1, 2)) for r, t in zip(self.points_ref, self.points_test)]
+        # reshape (2,) to 2D array
+        if len(pairs) == 0 or not all(np.any(r) and np.any(t) for r, t in pairs):
+            return np.inf
+
+        if self.hausdorff_method == "kdtree":
+            distances = find_nearest_distances_kdtree(pairs=pairs)
         else:
-            max_hausdorff = np.inf
+            if self.hausdorff_method == "edt":
+                pair_distances = [find_nearest_distances_edt(coords1=r, coords2=t) for r, t in pairs]
+            else:
+                pair_distances = [find_nearest_distances_cdist(coords1=r, coords2=t) for r, t in pairs]
+            # the same order as the k-d tree result: all the distances from the reference points first
+            distances = np.concatenate([d for d, _ in pair_distances] + [d for _, d in pair_distances])
+
+        self.hausdorff_95 = float(np.percentile(distances, 95))
+        self.average_surface_distance = float(np.mean(distances))
+
+        return np.max(distances)
+
+
+class VolumeOverlapCalculator:
+    """
+    Calculates the Dice and Jaccard indices of all the slices of a patient and of the whole volume.
+
+    The masks are converted to boolean volumes once, the foreground and the intersection voxels
+    are counted slice by slice along the in-plane axes, the indices are calculated from the counts.
+    The slice values are the same as the ones of TraditionalMetricsCalculator
+    (0 if the reference or the test mask of the slice is empty).
+
+    Args:
+        volume_ref: the 3D reference mask (slices along the first axis)
+        volume_test: the 3D test mask (only the common slices are used)
+
+    Returns:
+        dice: the Dice index of each slice
+        jaccard: the Jaccard index of each slice
+        volume_dice: the Dice index of the whole volume
+        volume_jaccard: the Jaccard index of the whole volume
+    """
+
+    def __init__(self, volume_ref: np.ndarray, volume_test: np.ndarray):
+        number_of_slices = min(volume_ref.shape[0], volume_test.shape[0])
+        binary_ref = volume_ref[:number_of_slices] != 0
+        binary_test = volume_test[:number_of_slices] != 0
+
+        self.count_ref = np.count_nonzero(binary_ref, axis=(1, 2))
+        self.count_test = np.count_nonzero(binary_test, axis=(1, 2))
+        self.count_intersection = np.count_nonzero(binary_ref & binary_test, axis=(1, 2))
+
+        self.dice, self.jaccard = VolumeOverlapCalculator.find_indices(
+            count_ref=self.count_ref, count_test=self.count_test, count_intersection=self.count_intersection)
+        volume_dice, volume_jaccard = VolumeOverlapCalculator.find_indices(
+            count_ref=self.count_ref.sum(keepdims=True), count_test=self.count_test.sum(keepdims=True),
+            count_intersection=self.count_intersection.sum(keepdims=True))
+        self.volume_dice = volume_dice[0]
+        self.volume_jaccard = volume_jaccard[0]
+
+    @staticmethod
+    def find_indices(count_ref: np.ndarray, count_test: np.ndarray,
+                     count_intersection: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calculates the Dice and Jaccard indices from the voxel counts (0 where one of the masks is empty).
+        """
+        is_valid = (count_ref > 0) & (count_test > 0)
+        count_ref = count_ref.astype(np.int64)
+        count_test = count_test.astype(np.int64)
+        count_intersection = count_intersection.astype(np.int64)
+
+        dice = np.zeros(count_ref.shape)
+        dice[is_valid] = 2 * count_intersection[is_valid] / (count_ref[is_valid] + count_test[is_valid])
+        jaccard = np.zeros(count_ref.shape)
+        jaccard[is_valid] = count_intersection[is_valid] / (
+                count_ref[is_valid] + count_test[is_valid] - count_intersection[is_valid])
+
+        return dice, jaccard
+
+
+def find_nearest_distances_cdist(coords1: np.ndarray, coords2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the nearest point distances of two contours in both directions from the full table of distances.
+
+    Returns:
+        distances1: the distance of each point of the first contour from the second contour
+        distances2: the distance of each point of the second contour from the first contour
+    """
+    distances = cdist(coords1, coords2)
+
+    return np.min(distances, axis=1), np.min(distances, axis=0)
+
+
+def find_nearest_distances_edt(coords1: np.ndarray, coords2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the nearest point distances of two contours in both directions with the Euclidean distance transform
+    of the common bounding box of the contours (the memory usage grows with the area of the box).
+    """
+    corner = np.minimum(coords1.min(axis=0), coords2.min(axis=0))
+    shape = tuple(np.maximum(coords1.max(axis=0), coords2.max(axis=0)) - corner + 1)
+
+    def distances_from(source: np.ndarray, target: np.ndarray) -> np.ndarray:
+        # the distance of each pixel of the box from the closest target point
+        not_target = np.ones(shape, dtype=bool)
+        not_target[tuple((target - corner).T)] = False
+        return distance_transform_edt(not_target)[tuple((source - corner).T)]
+
+    return distances_from(source=coords1, target=coords2), distances_from(source=coords2, target=coords1)
+
+
+def find_nearest_distances_kdtree(pairs: List[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+    """
+    Finds the nearest point distances of several contour pairs in both directions with one k-d tree query
+    for each direction (the distances from the first contours of all the pairs, then from the second contours).
+
+    Each pair is moved to a separate layer along an additional coordinate. The layers are farther from each other
+    than any two points of a pair, so the nearest point is always found in the same pair,
+    and the additional coordinate does not change the distances.
+    """
+    lengths1 = [len(c1) for c1, _ in pairs]
+    lengths2 = [len(c2) for _, c2 in pairs]
+    coords1 = np.concatenate([c1 for c1, _ in pairs]).astype(np.float64)
+    coords2 = np.concatenate([c2 for _, c2 in pairs]).astype(np.float64)
+
+    low = np.minimum(coords1.min(axis=0), coords2.min(axis=0))
+    high = np.maximum(coords1.max(axis=0), coords2.max(axis=0))
+    layer_distance = 2 * np.sum(high - low) + 1
+    layers1 = np.repeat(np.arange(len(pairs)), lengths1).reshape((-1, 1)) * layer_distance
+    layers2 = np.repeat(np.arange(len(pairs)), lengths2).reshape((-1, 1)) * layer_distance
+    points1 = np.hstack([coords1, layers1])
+    points2 = np.hstack([coords2, layers2])
+
+    distances1, _ = cKDTree(points2).query(points1, k=1)
+    distances2, _ = cKDTree(points1).query(points2, k=1)
 
-        return max_hausdorff
+    return np.concatenate([distances1, distances2])
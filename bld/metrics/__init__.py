@@ -1,4 +1,8 @@
 from .distance_calculator import DistanceCalculator
 from .bld_calculator import BLDCalculator
+from .kdtree_bld_calculator import KDTreeBLDCalculator
+from .tiled_bld_calculator import TiledBLDCalculator
 from .evaluation_metrics import EvaluationMetrics
-from .msi_calculator import MSICalculator, move_coms, check_duplicate
+from .contour_resampler import ContourResampler
+from .msi_calculator import MSICalculator, move_coms
+from .volumetric_msi_calculator import VolumetricMSICalculator, VolumetricBLDCalculator
@@ -1,4 +1,5 @@
-import cv2 as cv
+from typing import Optional, Tuple
+
 import numpy as np
 import pandas as pd
 
@@ -12,6 +13,7 @@ class BLDCalculator:
     Args:
         dist_calc: DistanceCalculator class with the pairwise distances
         test_points: the test point's numpy array
+        move_vector: the vector which aligned the test contour (None: the difference of the COMs)
 
     Returns:
         visualization_data: contains bmaxd_indices, fmind and bmaxd, which are necessary for visualization
@@ -19,24 +21,39 @@ class BLDCalculator:
         dist_bld_signed: signed BLD values (inside or outside location)
         final_bld: numpy array of the BLD values calculated after moving back the test contour
         location: 1 if the test point is inside, 0 if on the reference contour, -1 if outside
+        row_bld_indices: the index of the test point paired to each reference point based on BLD
         paired_test_points_moved_back: numpy array containing the test points
             which are pairs of reference contour points based on BLD
     """
 
     def __init__(self, dist_calc: DistanceCalculator,
-                 test_points: np.ndarray):
-        self.distance_df = dist_calc.distance_table
+                 test_points: np.ndarray,
+                 move_vector: Optional[np.ndarray] = None):
+        self.dist_calc = dist_calc
+        self.distance_matrix = dist_calc.pairwise_distance
         self.reference_points = dist_calc.reference_contour
         self.test_corrected_points = dist_calc.test_contour
         self.test_points = test_points
+        self.move_vector = move_vector
 
         self.visualization_data: dict = dict()
         self.dist_bld: list = []
         self.dist_bld_signed: list = []
         self.final_bld: list = []
         self.location: list = []
+        self.row_bld_indices: np.ndarray = np.array([], dtype=np.int_)
         self.paired_test_points_moved_back: np.ndarray = np.array([], dtype=np.int_)
 
+    @property
+    def distance_df(self) -> pd.DataFrame:
+        """
+        The labelled table of the pairwise distances (created by the DistanceCalculator on request).
+        """
+        if self.dist_calc is None:
+            return None
+
+        return self.dist_calc.distance_table
+
     def run(self):
         self.calculate_bld()
         self.calculate_signed_distances()
@@ -46,47 +63,37 @@ class BLDCalculator:
         """
         Calculates the BLD to each reference point.
         """
+        number_of_ref_points = self.distance_matrix.shape[0]
+
+        # the rows correspond to the reference points
+        # the row minimum is the forward minimal distance (FMinD)
+        row_min = self.distance_matrix.min(axis=1)
 
         # the columns correspond to the test points
         # the column minimum is the minimum distance from the reference points
-        column_min_indices = np.argmin(self.distance_df.values, axis=0)
+        column_min_indices = np.argmin(self.distance_matrix, axis=0)
+        column_min = self.distance_matrix.min(axis=0)
 
-        table = np.array(
-            column_min_indices.reshape((-1, 1)) ==
-            np.arange(0, self.distance_df.shape[0], 1).reshape((1, -1))
-        )
         # filtering the reference points (rows) to which there exist column minimum
-        filter_row_index_where_exists_column_min = (table.sum(axis=0)) > 0
-        # the BMaxD is the maximum of the column minimums
+        filter_row_index_where_exists_column_min = np.zeros((number_of_ref_points,), dtype=bool)
+        filter_row_index_where_exists_column_min[column_min_indices] = True
         # we find the indices of BMaxD distances
         bmaxd_indices = np.arange(
-            0, self.distance_df.shape[0], 1
+            0, number_of_ref_points, 1
         )[filter_row_index_where_exists_column_min]
-        # if there is no BMaxD, then FMinD is used
-        # we find the indices of FMinD distances
-        fmind_indices = np.arange(
-            0, self.distance_df.shape[0], 1
-        )[~filter_row_index_where_exists_column_min]
-
-        bld = np.zeros((self.distance_df.shape[0],))
-
-        # we find the values of FMinD distances
-        bld[fmind_indices] = self.distance_df.min(axis=1).iloc[fmind_indices]
 
-        table_2 = (column_min_indices.reshape((1, -1)) ==
-                   np.arange(0, self.distance_df.shape[0], 1).reshape((-1, 1)))
-
-        # we find the values of BMaxD distances
-        bmaxd = np.max(table_2 * self.distance_df.min(axis=0).values.reshape((-1,)),
-                       axis=1
-                       )[bmaxd_indices]
+        # the BMaxD is the maximum of the column minimums
+        bmaxd_all = np.zeros((number_of_ref_points,))
+        np.maximum.at(bmaxd_all, column_min_indices, column_min)
+        bmaxd = bmaxd_all[bmaxd_indices]
 
-        fmind = self.distance_df.min(axis=1).iloc[bmaxd_indices].values
+        fmind = row_min[bmaxd_indices]
 
         # BLD is the maximum of BMaxD and FMinD
-        bld_bmaxd_exists = np.maximum(bmaxd, fmind)
         # if BMaxD does not exist, then BLD = FMinD
-        bld[bmaxd_indices] = bld_bmaxd_exists
+        bld = row_min.copy()
+        bld[bmaxd_indices] = np.maximum(bmaxd, fmind)
+
         self.visualization_data = {
             "bmaxd_indices": bmaxd_indices,
             "fmind": fmind,
@@ -94,29 +101,24 @@ class BLDCalculator:
         }
         self.dist_bld = bld
 
+        # we assign the pairs to the reference contour points:
+        # the pair is the first test point, whose distance equals to the BLD
+        # where BLD = FMinD, this is the first row minimum
+        row_bld_indices = np.argmin(self.distance_matrix, axis=1)
+        bmaxd_rows = bmaxd_indices[bmaxd > fmind]
+        row_bld_indices[bmaxd_rows] = np.argmax(
+            self.distance_matrix[bmaxd_rows] == bld[bmaxd_rows].reshape((-1, 1)),
+            axis=1)
+        self.row_bld_indices = row_bld_indices
+
     def calculate_signed_distances(self):
         """
         Finds if a test point is inside or outside the reference contour and gives signed BLD.
         """
 
-        # polygon is a list of tuples representing the vertices of the polygon
-        polygon = []
-        for i in range(self.test_corrected_points.shape[1]):
-            px = self.test_corrected_points.T[i][0]
-            py = self.test_corrected_points.T[i][1]
-            polygon.append((px, py))
-        poly = np.array(polygon, dtype=np.float32)
-
-        location = []
-        for i in range(self.reference_points.shape[1]):
-            # 1: inside, 0: on the contour, -1: outside
-            pt = (np.float32(self.reference_points.T[i][0]),
-                  np.float32(self.reference_points.T[i][1]))
-            location.append(
-                cv.pointPolygonTest(poly,
-                                    pt,
-                                    False))
-        loc = np.array(location)
+        # 1: inside, 0: on the contour, -1: outside
+        loc = points_polygon_test(points=self.reference_points.T,
+                                  polygon=self.test_corrected_points.T)
         bld_signed = np.multiply(loc, self.dist_bld)
         self.dist_bld_signed = bld_signed
         self.location = loc
@@ -126,29 +128,19 @@ class BLDCalculator:
         Calculates the BLD distances after moving back the test contour to the original location.
         """
 
-        row_bld_indices = np.zeros(len(self.distance_df))
-        for i in range(len(self.distance_df)):
-            # we assign the pairs to the reference contour points
-            # Select the first index if np.argwhere returns a 2D array
-            idx = np.argwhere(self.distance_df.iloc[i].values == self.dist_bld[i])
-            if idx.ndim > 1:
-                idx = idx[0]
-            row_bld_indices[i] = idx
-
-        test_df = pd.DataFrame(self.test_corrected_points.T, columns=['x', 'y'])
-        list_row_bld_indices = row_bld_indices.tolist()
-        test_paired = test_df.iloc[list_row_bld_indices]
+        test_points_paired = self.test_corrected_points.T[self.row_bld_indices]
 
         # we move back the test points to the original location
         # we only use the test points, which are paired with reference points
         # these test points are in the same order as the reference points
         # (the pair of the ith reference point is the ith test point)
 
-        test_points_paired = test_paired.to_numpy()
-
-        com_ref = self.reference_points.T.mean(axis=0)
-        com_test = self.test_points.T.mean(axis=0)
-        move_vector = com_ref - com_test
+        if self.move_vector is None:
+            com_ref = self.reference_points.T.mean(axis=0)
+            com_test = self.test_points.T.mean(axis=0)
+            move_vector = com_ref - com_test
+        else:
+            move_vector = self.move_vector
 
         paired_test_points_moved_back = test_points_paired - move_vector
 
@@ -158,3 +150,99 @@ class BLDCalculator:
         )  # calculate the distance of the points in each pair
         self.final_bld = final_bld
         self.paired_test_points_moved_back = paired_test_points_moved_back
+
+
+def points_polygon_test(points: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """
+    Finds the location of all the points compared to a polygon in one vectorized pass.
+    The result is the same as calling cv.pointPolygonTest(polygon, point, False) for each point
+    with float32 coordinates, including the points on the edges and vertices.
+
+    Only the (point, edge) pairs, where the edge spans the row of the point, are evaluated,
+    so the cost grows nearly linearly with the number of points and vertices.
+
+    Args:
+        points: the points (one point in each row)
+        polygon: the vertices of the polygon (one vertex in each row)
+
+    Returns:
+        location: 1 if the point is inside, 0 if on the polygon, -1 if outside
+    """
+    pts = np.asarray(points, dtype=np.float32).reshape((-1, 2))
+    v = np.asarray(polygon, dtype=np.float32).reshape((-1, 2))
+    location = np.full((pts.shape[0],), -1.0)
+    if v.shape[0] == 0 or pts.shape[0] == 0:
+        return location
+
+    # each edge goes from the previous vertex (v0) to the current one (v), the first edge starts at the last vertex
+    v0 = np.roll(v, 1, axis=0)
+    p_x, p_y = pts[:, 0], pts[:, 1]
+    v_x, v_y, v0_x, v0_y = v[:, 0], v[:, 1], v0[:, 0], v0[:, 1]
+
+    # the points sorted by their y coordinate, the points of a row form a contiguous range
+    order = np.argsort(p_y, kind="stable")
+    sorted_y = p_y[order]
+
+    # the points which are vertices of the polygon are on the contour
+    on_contour = np.isin(as_point_keys(pts), as_point_keys(v))
+
+    # the points on a horizontal edge are on the contour
+    horizontal = np.nonzero(v0_y == v_y)[0]
+    edges, pairs = find_pairs_in_ranges(
+        order=order,
+        starts=np.searchsorted(sorted_y, v_y[horizontal], side="left"),
+        ends=np.searchsorted(sorted_y, v_y[horizontal], side="right"))
+    edges = horizontal[edges]
+    between = (((v0_x[edges] <= p_x[pairs]) & (p_x[pairs] <= v_x[edges])) |
+               ((v_x[edges] <= p_x[pairs]) & (p_x[pairs] <= v0_x[edges])))
+    on_contour[pairs[between]] = True
+
+    # the edges crossing the row of the point: min(y) <= point y < max(y)
+    crossing = np.nonzero(v0_y != v_y)[0]
+    edges, pairs = find_pairs_in_ranges(
+        order=order,
+        starts=np.searchsorted(sorted_y, np.minimum(v0_y, v_y)[crossing], side="left"),
+        ends=np.searchsorted(sorted_y, np.maximum(v0_y, v_y)[crossing], side="left"))
+    edges = crossing[edges]
+    # the edges entirely on the left side of the point are not crossed by the ray going to the right
+    right = ~((v0_x[edges] < p_x[pairs]) & (v_x[edges] < p_x[pairs]))
+    edges, pairs = edges[right], pairs[right]
+
+    dist = ((p_y[pairs] - v0_y[edges]).astype(np.float64) * (v_x[edges] - v0_x[edges]).astype(np.float64) -
+            (p_x[pairs] - v0_x[edges]).astype(np.float64) * (v_y[edges] - v0_y[edges]).astype(np.float64))
+    on_contour[pairs[dist == 0]] = True
+    dist = np.where(v_y[edges] < v0_y[edges], -dist, dist)
+    counter = np.bincount(pairs[dist > 0], minlength=pts.shape[0])
+
+    location[counter % 2 == 1] = 1.0
+    location[on_contour] = 0.0
+
+    return location
+
+
+def as_point_keys(points: np.ndarray) -> np.ndarray:
+    """
+    Converts float32 2D points to int64 keys, equal points have equal keys (-0.0 is changed to 0.0).
+    """
+    return np.ascontiguousarray(points + np.float32(0), dtype=np.float32).view(np.int64).ravel()
+
+
+def find_pairs_in_ranges(order: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Expands ranges of a sorted array to index pairs.
+
+    Args:
+        order: the original indices of the sorted elements
+        starts: the first sorted position of each range
+        ends: the position after the last sorted position of each range
+
+    Returns:
+        range_indices: the index of the range of each pair
+        element_indices: the original index of the element of each pair
+    """
+    lengths = ends - starts
+    range_indices = np.repeat(np.arange(len(lengths)), lengths)
+    offsets = np.arange(range_indices.shape[0]) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    element_indices = order[np.repeat(starts, lengths) + offsets]
+
+    return range_indices, element_indices
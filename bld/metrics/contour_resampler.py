@@ -0,0 +1,111 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class ContourResampler:
+    """
+    Reduces the number of contour points before the BLD calculation.
+
+    The reference contour is reduced to a subset of its original points, picked at equal arc length steps:
+    the step is the target spacing, or it is increased so that the reference contour has at most max_points
+    points. No new points are interpolated, so the points stay on the pixel grid. The test contour keeps
+    the points needed by the kept reference points (after aligning the COMs of the full contours):
+    the closest test point of each kept reference point, and the test points whose closest reference point
+    is kept. MSICalculator aligns the reduced contours by the COMs of the full contours as well, so the
+    coincident reference and test points keep their zero BLD (weight 0 in the MSI).
+    The contours which already have fewer points are not changed (the contours are never upsampled).
+
+    The remaining bias: the MSI is the mean over the kept reference points only, and a kept test point
+    whose closest reference point was dropped is measured from a kept reference point, which can increase
+    the BLD. On the synthetic slices of benchmarks.bench_resampling the MSI deviates by at most about 0.015
+    for slightly different shapes and about 0.05 for partially coincident contours (max 128 points).
+    Short contours keep only a few points, so their MSI deviates more (up to about 0.3 for contours of a few
+    dozen points with spacing 4).
+
+    Args:
+        spacing: the target distance of the neighbouring reference points along the contour (None: no target)
+        max_points: the maximal number of points of a reference contour (None: no limit)
+
+    Returns:
+        run returns the reduced reference and test contours (the same layout as the input: one coordinate
+        in each row)
+    """
+
+    def __init__(self, spacing: Optional[float] = None, max_points: Optional[int] = None):
+        if spacing is not None and spacing <= 0:
+            raise ValueError("The spacing must be positive: %s" % spacing)
+        if max_points is not None and max_points < 3:
+            raise ValueError("A contour needs at least 3 points: %s" % max_points)
+
+        self.spacing = spacing
+        self.max_points = max_points
+
+    def run(self, r: np.ndarray, t: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if r.ndim != 2 or t.ndim != 2 or r.shape[1] < 4 or t.shape[1] == 0:
+            return r, t
+        if self.spacing is None and (self.max_points is None or self.max_points >= r.shape[1]):
+            return r, t
+
+        ref_indices = self.find_reference_indices(contour=r)
+        if ref_indices.shape[0] >= r.shape[1]:
+            return r, t
+
+        return r[:, ref_indices], t[:, find_test_mask(r=r, t=t, ref_indices=ref_indices)]
+
+    def find_reference_indices(self, contour: np.ndarray) -> np.ndarray:
+        """
+        Picks the indices of the kept points of a closed contour at equal arc length steps.
+        """
+        closed = np.concatenate([contour, contour[:, :1]], axis=1).astype(np.float64)
+        arc_length = np.concatenate([[0.0], np.cumsum(np.sqrt(np.sum(np.diff(closed, axis=1) ** 2, axis=0)))])
+        perimeter = arc_length[-1]
+
+        number_of_points = contour.shape[1]
+        if self.spacing is not None:
+            number_of_points = min(number_of_points, int(np.ceil(perimeter / self.spacing)))
+        if self.max_points is not None:
+            number_of_points = min(number_of_points, self.max_points)
+        if number_of_points >= contour.shape[1] or perimeter == 0:
+            return np.arange(contour.shape[1])
+
+        return pick_closed_contour_points(arc_length=arc_length, number_of_points=max(number_of_points, 3))
+
+
+def pick_closed_contour_points(arc_length: np.ndarray, number_of_points: int) -> np.ndarray:
+    """
+    Picks the first point at or after each equal arc length step along a closed polyline,
+    starting at its first point.
+
+    Args:
+        arc_length: the arc length at each point of the polyline, the last value is the perimeter
+        number_of_points: the number of the steps
+
+    Returns:
+        indices: the sorted indices of the picked points (without repetition)
+    """
+    positions = np.arange(number_of_points) * (arc_length[-1] / number_of_points)
+    indices = np.searchsorted(arc_length[:-1], positions, side='left')
+
+    return np.unique(np.clip(indices, 0, len(arc_length) - 2))
+
+
+def find_test_mask(r: np.ndarray, t: np.ndarray, ref_indices: np.ndarray) -> np.ndarray:
+    """
+    Finds the test points needed by the kept reference points, after aligning the COMs:
+    the closest test point of each kept reference point and the test points whose closest reference point is kept.
+
+    Returns:
+        mask: True for the kept test points
+    """
+    t_corrected = t + (r.mean(axis=1) - t.mean(axis=1)).reshape((-1, 1))
+    is_kept_ref = np.zeros((r.shape[1],), dtype=bool)
+    is_kept_ref[ref_indices] = True
+
+    _, closest_ref = cKDTree(r.T).query(t_corrected.T)
+    _, closest_test = cKDTree(t_corrected.T).query(r[:, ref_indices].T)
+    mask = is_kept_ref[closest_ref]
+    mask[closest_test] = True
+
+    return mask
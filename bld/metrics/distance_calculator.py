@@ -1,3 +1,5 @@
+from typing import Optional
+
 import numpy as np
 import pandas as pd
 
@@ -12,7 +14,7 @@ class DistanceCalculator:
 
     Returns:
         pairwise_distances: the Euclidean distance between the reference and test contour points
-        distance_table: table of the pairwise distances
+        distance_table: table of the pairwise distances (it is created at the first access)
     """
 
     def __init__(self, reference_contour: np.ndarray,
@@ -21,11 +23,25 @@ class DistanceCalculator:
         self.test_contour = test_contour
 
         self.pairwise_distance: np.ndarray = np.array([], dtype=np.float64)
-        self.distance_table: pd.DataFrame = pd.DataFrame()
+        self._distance_table: Optional[pd.DataFrame] = None
 
     def run(self):
         self.pairwise_distance = self.find_pairwise_dist()
-        self.distance_table = self.create_table()
+        self._distance_table = None
+
+    @property
+    def distance_table(self) -> pd.DataFrame:
+        """
+        The labelled table of the pairwise distances.
+        The BLD calculation works on the pairwise_distance array, the table is only created
+        (and then stored) when it is asked for, e.g. for formatting or for the local distance profile.
+        """
+        if self.pairwise_distance.size == 0:
+            return pd.DataFrame()
+        if self._distance_table is None:
+            self._distance_table = self.create_table()
+
+        return self._distance_table
 
     def find_pairwise_dist(self) -> np.ndarray:
         """
@@ -35,11 +51,9 @@ class DistanceCalculator:
         c_ref = self.reference_contour.T
         c_test = self.test_contour.T
 
-        n_1 = c_ref.shape[0]
-        v1v2 = c_ref @ c_test.T
-        v12 = np.sum(c_ref ** 2, axis=1).reshape((n_1, 1))
-        v22 = np.sum(c_test ** 2, axis=1)
-        pairwise_dist = np.sqrt(v12 - 2 * v1v2 + v22)        # n_2 = c_test.shape[0]
+        pairwise_dist = find_paired_distances(
+            c_ref=c_ref[:, np.newaxis, :],
+            c_test=c_test[np.newaxis, :, :])
 
         return pairwise_dist
 
@@ -61,3 +75,31 @@ class DistanceCalculator:
         df = pd.DataFrame(data=self.pairwise_distance, columns=cols, index=ind)
 
         return df
+
+
+def find_paired_distances(c_ref: np.ndarray, c_test: np.ndarray) -> np.ndarray:
+    """
+    Finds the Euclidean distances between corresponding reference and test points.
+
+    The arrays are broadcast against each other, the last axis contains the coordinates.
+    The scalar products are computed coordinate by coordinate (not with a matrix product),
+    so the distance of a point pair is always the same bit by bit,
+    whether it is computed for the whole table or only for a few selected pairs.
+
+    Args:
+        c_ref: the reference points, the last axis contains the coordinates
+        c_test: the test points, the last axis contains the coordinates
+
+    Returns:
+        paired_dist: the distances with the broadcast shape of the inputs (without the last axis)
+    """
+
+    v1v2 = c_ref[..., 0] * c_test[..., 0]
+    for k in range(1, c_ref.shape[-1]):
+        v1v2 = v1v2 + c_ref[..., k] * c_test[..., k]
+    v12 = np.sum(c_ref ** 2, axis=-1)
+    v22 = np.sum(c_test ** 2, axis=-1)
+    # the rounding error can make the squared distance of (nearly) coincident points slightly negative
+    paired_dist = np.sqrt(np.maximum(v12 - 2 * v1v2 + v22, 0))
+
+    return paired_dist
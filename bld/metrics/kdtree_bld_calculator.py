@@ -0,0 +1,193 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from bld.metrics import BLDCalculator
+from bld.metrics.distance_calculator import find_paired_distances
+
+
+class KDTreeBLDCalculator(BLDCalculator):
+    """
+    Calculates the BLD with nearest neighbour queries instead of the full table of pairwise distances.
+
+    The FMinD, the column minima, the BMaxD and the BLD pairs are found with k-d tree queries,
+    so the memory usage grows nearly linearly with the number of contour points.
+    The candidate points of the queries are evaluated with the same distance function
+    as the dense table, therefore the results are identical to the ones of BLDCalculator
+    (including the first index choice in case of equal distances).
+    The points may have any number of coordinates (e.g. 3D surface points).
+
+    Args:
+        reference_points: the reference point's numpy array
+        test_corrected_points: the test point's numpy array after aligning the COMs
+        test_points: the test point's numpy array
+        move_vector: the vector which aligned the test contour (None: the difference of the COMs)
+
+    Returns:
+        visualization_data: contains bmaxd_indices, fmind and bmaxd, which are necessary for visualization
+        dist_bld: BLD values calculated after aligning the reference and test COMs
+        dist_bld_signed: signed BLD values (inside or outside location)
+        final_bld: numpy array of the BLD values calculated after moving back the test contour
+        location: 1 if the test point is inside, 0 if on the reference contour, -1 if outside
+        paired_test_points_moved_back: numpy array containing the test points
+            which are pairs of reference contour points based on BLD
+    """
+
+    def __init__(self, reference_points: np.ndarray,
+                 test_corrected_points: np.ndarray,
+                 test_points: np.ndarray,
+                 move_vector: Optional[np.ndarray] = None):
+        self.dist_calc = None
+        self.distance_matrix = None
+        self.reference_points = reference_points
+        self.test_corrected_points = test_corrected_points
+        self.test_points = test_points
+        self.move_vector = move_vector
+
+        self.c_ref = self.reference_points.T
+        self.c_test = self.test_corrected_points.T
+        self.ref_tree = cKDTree(self.c_ref)
+        self.test_tree = cKDTree(self.c_test)
+        self.tolerance = self.find_tolerance()
+
+        self.visualization_data: dict = dict()
+        self.dist_bld: list = []
+        self.dist_bld_signed: list = []
+        self.final_bld: list = []
+        self.location: list = []
+        self.row_min: np.ndarray = np.array([])
+        self.row_min_indices: np.ndarray = np.array([], dtype=np.int_)
+        self.row_bld_indices: np.ndarray = np.array([], dtype=np.int_)
+        self.paired_test_points_moved_back: np.ndarray = np.array([], dtype=np.int_)
+
+    def find_tolerance(self) -> float:
+        """
+        Finds the upper bound of the rounding error of the distance function.
+
+        The distances of the table are computed from the squared norms and the scalar products,
+        so the error of the squared distance is at most a few ulps of the largest squared norm.
+        """
+        max_norm_ref = np.max(np.sum(self.c_ref.astype(np.float64) ** 2, axis=1))
+        max_norm_test = np.max(np.sum(self.c_test.astype(np.float64) ** 2, axis=1))
+        eps = np.finfo(np.float64).eps
+
+        return float(np.sqrt(8 * eps * (max_norm_ref + max_norm_test))) + eps
+
+    def find_distances(self, ref_indices: np.ndarray, test_indices: np.ndarray) -> np.ndarray:
+        """
+        Finds the distances of the selected (reference, test) point pairs.
+        """
+        return find_paired_distances(c_ref=self.c_ref[ref_indices], c_test=self.c_test[test_indices])
+
+    def find_candidates(self, tree: cKDTree, query_points: np.ndarray,
+                        radius: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the points of the tree which are closer to the query points than the given radius.
+        The radius is extended with the rounding error of the distance function.
+
+        Returns:
+            query_indices: the index of the query point of each candidate pair
+            tree_indices: the index of the tree point of each candidate pair
+        """
+        radius = radius * (1 + 1e-9) + 2 * self.tolerance
+        candidates = tree.query_ball_point(query_points, r=radius)
+        lengths = np.fromiter((len(c) for c in candidates), dtype=np.int_, count=len(candidates))
+        query_indices = np.repeat(np.arange(len(candidates)), lengths)
+        tree_indices = np.fromiter(
+            (i for c in candidates for i in c), dtype=np.int_, count=int(lengths.sum()))
+
+        return query_indices, tree_indices
+
+    def find_nearest(self, from_reference: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the minimal distance and the index of the closest point for each point of a contour.
+
+        Args:
+            from_reference: if True, the closest test point is searched for each reference point
+                (row minima of the distance table), otherwise the closest reference point
+                is searched for each test point (column minima of the distance table)
+
+        Returns:
+            min_distances: the minimal distances
+            min_indices: the first index where the minimal distance is reached
+        """
+        if from_reference:
+            tree, query_points = self.test_tree, self.c_ref
+        else:
+            tree, query_points = self.ref_tree, self.c_test
+
+        nearest_distances, _ = tree.query(query_points, k=1)
+        query_indices, tree_indices = self.find_candidates(
+            tree=tree, query_points=query_points, radius=nearest_distances)
+
+        if from_reference:
+            distances = self.find_distances(ref_indices=query_indices, test_indices=tree_indices)
+        else:
+            distances = self.find_distances(ref_indices=tree_indices, test_indices=query_indices)
+
+        # sort the candidates by query point, then by distance, then by index
+        # the first candidate of each query point is the minimum with the smallest index
+        order = np.lexsort((tree_indices, distances, query_indices))
+        first = order[np.searchsorted(query_indices[order], np.arange(len(query_points)))]
+
+        return distances[first], tree_indices[first]
+
+    def calculate_bld(self):
+        """
+        Calculates the BLD to each reference point.
+        """
+        number_of_ref_points = self.c_ref.shape[0]
+
+        row_min, row_min_indices = self.find_nearest(from_reference=True)
+        column_min, column_min_indices = self.find_nearest(from_reference=False)
+
+        # the reference points (rows) to which there exist column minimum
+        filter_row_index_where_exists_column_min = np.zeros((number_of_ref_points,), dtype=bool)
+        filter_row_index_where_exists_column_min[column_min_indices] = True
+        bmaxd_indices = np.arange(
+            0, number_of_ref_points, 1
+        )[filter_row_index_where_exists_column_min]
+
+        # the BMaxD is the maximum of the column minimums
+        bmaxd_all = np.zeros((number_of_ref_points,))
+        np.maximum.at(bmaxd_all, column_min_indices, column_min)
+        bmaxd = bmaxd_all[bmaxd_indices]
+
+        fmind = row_min[bmaxd_indices]
+
+        # BLD is the maximum of BMaxD and FMinD, if BMaxD does not exist, then BLD = FMinD
+        bld = row_min.copy()
+        bld[bmaxd_indices] = np.maximum(bmaxd, fmind)
+
+        self.visualization_data = {
+            "bmaxd_indices": bmaxd_indices,
+            "fmind": fmind,
+            "bmaxd": bmaxd
+        }
+        self.dist_bld = bld
+        self.row_min = row_min
+        self.row_min_indices = row_min_indices
+        self.row_bld_indices = self.find_bld_pairs()
+
+    def find_bld_pairs(self) -> np.ndarray:
+        """
+        Finds the first test point for each reference point, whose distance equals to the BLD.
+        Where the BLD is the FMinD, the pair is the closest test point, which is already known,
+        the test points are only searched for the reference points where the BMaxD is larger.
+        """
+        row_bld_indices = self.row_min_indices.copy()
+        bmaxd_rows = np.flatnonzero(self.dist_bld > self.row_min)
+        if bmaxd_rows.shape[0] == 0:
+            return row_bld_indices
+
+        query_indices, tree_indices = self.find_candidates(
+            tree=self.test_tree, query_points=self.c_ref[bmaxd_rows], radius=self.dist_bld[bmaxd_rows])
+        query_indices = bmaxd_rows[query_indices]
+        distances = self.find_distances(ref_indices=query_indices, test_indices=tree_indices)
+        is_pair = distances == self.dist_bld[query_indices]
+
+        row_bld_indices[bmaxd_rows] = self.c_test.shape[0]
+        np.minimum.at(row_bld_indices, query_indices[is_pair], tree_indices[is_pair])
+
+        return row_bld_indices
@@ -1,9 +1,10 @@
-from typing import Union, List
+from typing import Optional, Union, List
 
 import numpy as np
-import pandas as pd
+from scipy.optimize import linear_sum_assignment
 
 import bld.metrics as bldm
+from bld.utils.profiling import Profiler
 
 
 class MSICalculator:
@@ -15,92 +16,256 @@ class MSICalculator:
         ol: outside penalty level
         test_points: the test points array (coordinates)
         ref_points: the reference points array (coordinates)
+        engine: 'dense' computes the BLD from the full table of pairwise distances,
+            'kdtree' computes the same BLD with nearest neighbour queries (for long contours),
+            'tiled' computes the same BLD from blocks of the distance table (for bounded memory usage)
+        pairing: 'greedy' pairs each reference contour with the test contour of the closest COM,
+            'one_to_one' finds the pairs with the minimal sum of COM distances (Hungarian method),
+            so that each test contour is used at most once
+        resampler: if given, the contours of the pairs are resampled before the BLD calculation
+            (the final BLD values belong to the kept reference points)
+        memory_budget: the approximate memory of one block of distances in bytes ('tiled' engine)
+        profiler: records the time of the stages (pairing, distance table, BLD, point in polygon test, MSI)
 
     Returns:
-        msi: the calculated MSI values
+        msi: the calculated MSI values (one value for each contour pair)
+        final_bld: the final BLD values of the contour pairs (they do not depend on il and ol)
+        ref_points_in_order: the reference contours of the pairs
+        test_points_in_order: the test contours of the pairs
+        pairing_indices: the index of the paired test contour for each reference contour (-1: unmatched)
+        duplicates: the test contours paired with more than one reference contour
+            (test contour index: the indices of the reference contours), only in greedy mode
+        unmatched_ref: the indices of the reference contours without a pair
+        unmatched_test: the indices of the test contours without a pair
 
     """
-    def __init__(self, il: float, ol: float, test_points: np.ndarray, ref_points: np.ndarray):
+    engines = ("dense", "kdtree", "tiled")
+    pairings = ("greedy", "one_to_one")
+
+    def __init__(self, il: float, ol: float, test_points: np.ndarray, ref_points: np.ndarray,
+                 engine: Optional[str] = "dense", pairing: Optional[str] = "greedy",
+                 resampler: Optional[bldm.ContourResampler] = None, memory_budget: Optional[int] = 2 ** 26,
+                 profiler: Optional[Profiler] = None):
+        if engine not in MSICalculator.engines:
+            raise ValueError("Unknown BLD engine: %s (available: %s)" % (engine, ", ".join(MSICalculator.engines)))
+        if pairing not in MSICalculator.pairings:
+            raise ValueError("Unknown pairing: %s (available: %s)" % (pairing, ", ".join(MSICalculator.pairings)))
+
         self.test_points = test_points
         self.ref_points = ref_points
         self.il = il
         self.ol = ol
-
-        self.test_points_in_order = self.pair_contours()
+        self.engine = engine
+        self.pairing = pairing
+        self.resampler = resampler
+        self.memory_budget = memory_budget
+        self.profiler = Profiler(enabled=False) if profiler is None else profiler
+
+        self.pairing_indices: np.ndarray = np.array([], dtype=np.int_)
+        self.duplicates: dict = dict()
+        self.unmatched_ref: np.ndarray = np.array([], dtype=np.int_)
+        self.unmatched_test: np.ndarray = np.array([], dtype=np.int_)
+        self.ref_points_in_order: list = []
+        with self.profiler.stage("pair_contours", size=len(ref_points) * len(test_points)):
+            self.test_points_in_order = self.pair_contours()
         self.msi: list = []
+        self.final_bld: list = []
 
     def pair_contours(self) -> List:
         """
-        Pair the test and reference contours on a slice based on the closest center of mass
+        Pair the test and reference contours on a slice based on the closest center of mass.
+
+        The COM distances of all the (reference, test) contour pairs are calculated at once.
+        In greedy mode a test contour can be the pair of several reference contours,
+        these are reported in duplicates. The contours without a pair are reported in
+        unmatched_ref and unmatched_test.
+
+        Returns:
+            test_points_in_order: the test contours of the pairs (in the order of the reference contours)
         """
+        number_of_ref = len(self.ref_points)
+        number_of_test = len(self.test_points)
+        com_distances = find_com_distances(ref_points=self.ref_points, test_points=self.test_points)
+
+        if number_of_test == 0:
+            ref_indices = np.array([], dtype=np.int_)
+            test_indices = np.array([], dtype=np.int_)
+        elif self.pairing == "one_to_one":
+            ref_indices, test_indices = linear_sum_assignment(com_distances)
+        else:
+            # the first test contour with the minimal distance
+            ref_indices = np.arange(number_of_ref)
+            test_indices = np.argmin(com_distances, axis=1)
+
+        self.pairing_indices = np.full((number_of_ref,), -1, dtype=np.int_)
+        self.pairing_indices[ref_indices] = test_indices
+        self.unmatched_ref = np.flatnonzero(self.pairing_indices < 0)
+        self.unmatched_test = np.setdiff1d(np.arange(number_of_test), test_indices)
+
+        pair_counts = np.bincount(test_indices, minlength=number_of_test)
+        self.duplicates = {
+            int(t): np.flatnonzero(self.pairing_indices == t) for t in np.flatnonzero(pair_counts > 1)
+        }
+
+        self.ref_points_in_order = [self.ref_points[i] for i in ref_indices]
+
+        return [self.test_points[i] for i in test_indices]
 
-        def func_find_com(array):
-            if array.ndim == 1:  # Check if the array is 1D
-                return array
-            else:
-                com = array.mean(axis=1)
-                return com
+    def run(self):
+        self.run_bld()
+        with self.profiler.stage("msi", size=sum(len(final_bld) for final_bld in self.final_bld)):
+            for final_bld in self.final_bld:
+                self.msi.append(self.calculate_msi(final_bld=final_bld))
 
-        test_coms = list(map(func_find_com, self.test_points))
-        ref_coms = list(map(func_find_com, self.ref_points))
+    def run_bld(self):
+        """
+        Calculate the final BLD values of all the contour pairs (only once).
+        """
+        if len(self.final_bld) == 0:
+            for r, t in zip(self.ref_points_in_order, self.test_points_in_order):
+                self.final_bld.append(self.find_final_bld(r=r, t=t))
 
-        test_points_in_order = []
-        indices = []
-        for c in ref_coms:
-            res = [np.linalg.norm(x - c) for x in test_coms]
-            p = min(res)
-            test_points_in_order.append(self.test_points[res.index(p)])
-            indices.append(res.index(p))
+    def sweep(self, il_values: List[float], ol_values: List[float]) -> np.ndarray:
+        """
+        Calculate MSI for all the contours and all the combinations of the penalty levels.
+        The BLD values are calculated once, the MSI values of the grid are calculated in one vectorized pass.
 
-        return test_points_in_order
+        Args:
+            il_values: the inside penalty levels
+            ol_values: the outside penalty levels
 
-    def run(self):
-        for r, t in zip(self.ref_points, self.test_points_in_order):
-            self.msi.append(self.run_for_single_contour(r=r, t=t))
+        Returns:
+            msi: numpy array of shape (number of contours, number of il values, number of ol values)
+        """
+        self.run_bld()
 
-    def run_for_single_contour(self, r: np.ndarray, t: np.ndarray) -> pd.Series:
+        return MSICalculator.calculate_msi_grid(final_blds=self.final_bld, il_values=il_values, ol_values=ol_values)
+
+    def run_for_single_contour(self, r: np.ndarray, t: np.ndarray) -> float:
         """
         Calculate MSI for a single contour.
         """
+        return self.calculate_msi(final_bld=self.find_final_bld(r=r, t=t))
+
+    def find_final_bld(self, r: np.ndarray, t: np.ndarray) -> np.ndarray:
+        """
+        Calculate the final BLD values for a single contour.
+        """
+        # the resampled contours are aligned by the COMs of the full contours
+        move_vector = None
+        if self.resampler is not None:
+            with self.profiler.stage("resample_contours", size=r.size // 2 + t.size // 2):
+                move_vector = find_move_vector(c_ref=r, c_test=t)
+                r, t = self.resampler.run(r=r, t=t)
+
         test_contour = t
         reference_contour = r
+        number_of_ref_points = reference_contour.size // 2
+        number_of_distances = number_of_ref_points * (test_contour.size // 2)
 
         points_test_corrected = move_coms(c_ref=reference_contour,
-                                          c_test=test_contour)
-
-        dist_calc = bldm.DistanceCalculator(
-            reference_contour=reference_contour,
-            test_contour=points_test_corrected)
-        dist_calc.run()
+                                          c_test=test_contour,
+                                          move_vector=move_vector)
+
+        if self.engine == "kdtree":
+            with self.profiler.stage("kdtree", size=number_of_ref_points + test_contour.size // 2):
+                bld_calc = bldm.KDTreeBLDCalculator(
+                    reference_points=reference_contour,
+                    test_corrected_points=points_test_corrected,
+                    test_points=test_contour,
+                    move_vector=move_vector)
+        elif self.engine == "tiled":
+            bld_calc = bldm.TiledBLDCalculator(
+                reference_points=reference_contour,
+                test_corrected_points=points_test_corrected,
+                test_points=test_contour,
+                memory_budget=self.memory_budget,
+                move_vector=move_vector)
+        else:
+            with self.profiler.stage("distance_table", size=number_of_distances):
+                dist_calc = bldm.DistanceCalculator(
+                    reference_contour=reference_contour,
+                    test_contour=points_test_corrected)
+                dist_calc.run()
+
+            bld_calc = bldm.BLDCalculator(dist_calc=dist_calc, test_points=test_contour,
+                                          move_vector=move_vector)
+
+        # the steps of bld_calc.run(), timed separately
+        with self.profiler.stage("bld", size=number_of_ref_points):
+            bld_calc.calculate_bld()
+        with self.profiler.stage("point_in_polygon", size=number_of_distances):
+            bld_calc.calculate_signed_distances()
+        with self.profiler.stage("corrected_bld", size=number_of_ref_points):
+            bld_calc.calculate_corrected_bld()
+
+        return bld_calc.final_bld
+
+    def calculate_msi(self, final_bld: list) -> float:
+        """
+        Calculates the value of MSI for the current slice.
+        """
+        return float(MSICalculator.calculate_msi_batch(final_blds=[final_bld], il=self.il, ol=self.ol)[0])
 
-        bld_calc = bldm.BLDCalculator(dist_calc=dist_calc, test_points=test_contour)
-        bld_calc.run()
+    @staticmethod
+    def calculate_msi_batch(final_blds: List[np.ndarray], il: float, ol: float) -> np.ndarray:
+        """
+        Calculates the MSI values of several contours at once.
 
-        msi = self.calculate_msi(final_bld=bld_calc.final_bld)
+        Args:
+            final_blds: the final BLD values of the contours
+            il: inside penalty level
+            ol: outside penalty level
 
-        return msi
+        Returns:
+            msi: numpy array with the MSI value of each contour
+        """
+        return MSICalculator.calculate_msi_grid(final_blds=final_blds, il_values=[il], ol_values=[ol])[:, 0, 0]
 
-    def calculate_msi(self, final_bld: list) -> pd.Series:
+    @staticmethod
+    def calculate_msi_grid(final_blds: List[np.ndarray],
+                           il_values: List[float], ol_values: List[float]) -> np.ndarray:
         """
-        Calculates the value of MSI for the current slice.
+        Calculates the MSI values of several contours for all the combinations of the penalty levels.
+
+        The inside and outside sums of the weight function are calculated separately,
+        the inside sum only depends on il, the outside sum only depends on ol.
+
+        Args:
+            final_blds: the final BLD values of the contours
+            il_values: the inside penalty levels
+            ol_values: the outside penalty levels
+
+        Returns:
+            msi: numpy array of shape (number of contours, number of il values, number of ol values)
         """
-        mcf_inside = pd.DataFrame(data=final_bld, columns=['corr.BLD'])
-        mcf_outside = pd.DataFrame(data=final_bld, columns=['corr.BLD'])
-        mcf_inside['WF value'] = MSICalculator.weight_function(
-            d=mcf_inside.loc[mcf_inside['corr.BLD'] < 0],
-            l=self.il)
-        mcf_outside['WF value'] = MSICalculator.weight_function(
-            d=mcf_outside.loc[mcf_outside['corr.BLD'] > 0],
-            l=self.ol)
-        msi = 1 / len(final_bld) * (
-                mcf_inside['WF value'].sum() + mcf_outside['WF value'].sum()
+        il = np.asarray(il_values, dtype=np.float64).reshape((-1, 1))
+        ol = np.asarray(ol_values, dtype=np.float64).reshape((-1, 1))
+        lengths = np.array([len(final_bld) for final_bld in final_blds], dtype=np.int_)
+        if len(final_blds) == 0:
+            return np.zeros((0, il.shape[0], ol.shape[0]))
+
+        d = np.concatenate([np.asarray(final_bld, dtype=np.float64) for final_bld in final_blds])
+        contour_indices = np.repeat(np.arange(len(final_blds)), lengths)
+
+        def sum_of_weights(is_selected: np.ndarray, levels: np.ndarray) -> np.ndarray:
+            # the rows correspond to the levels, the columns correspond to the contours
+            weights = MSICalculator.weight_function(d=d[is_selected].reshape((1, -1)), l=levels)
+            return np.array([np.bincount(contour_indices[is_selected], weights=w, minlength=len(final_blds))
+                             for w in weights]).reshape((levels.shape[0], len(final_blds)))
+
+        sum_inside = sum_of_weights(is_selected=d < 0, levels=il)
+        sum_outside = sum_of_weights(is_selected=d > 0, levels=ol)
+
+        msi = (1 / lengths).reshape((-1, 1, 1)) * (
+                sum_inside.T.reshape((len(final_blds), -1, 1)) + sum_outside.T.reshape((len(final_blds), 1, -1))
         )
 
         return msi
 
     @staticmethod
-    def weight_function(d: Union[float, pd.DataFrame],
-                        l: Union[float, pd.DataFrame]) -> Union[float, pd.DataFrame]:
+    def weight_function(d: Union[float, np.ndarray],
+                        l: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
         """
         Defines the weight function.
 
@@ -116,34 +281,59 @@ class MSICalculator:
         return wf
 
 
-def check_duplicate(items):
+def find_com(contour: np.ndarray) -> np.ndarray:
     """
-    Check if the pairing is not correct i.e. there is duplicate in the list.
+    Finds the center of mass of a contour (a single point contour is a 1D array).
     """
-    hash_bucket = set()
-    for item in items:
-        if item in hash_bucket:
-            return True
-        hash_bucket.add(item)
+    if contour.ndim == 1:
+        return contour
 
-    return False
+    return contour.mean(axis=1)
 
 
-def move_coms(c_ref: np.ndarray, c_test: np.ndarray) -> np.ndarray:
+def find_com_distances(ref_points: list, test_points: list) -> np.ndarray:
+    """
+    Calculates the distances between the COMs of the reference and the test contours.
+
+    Args:
+        ref_points: the reference contours
+        test_points: the test contours
+
+    Returns:
+        com_distances: numpy array of shape (number of reference contours, number of test contours)
+    """
+    ref_coms = np.array([find_com(c) for c in ref_points], dtype=np.float64).reshape((-1, 2))
+    test_coms = np.array([find_com(c) for c in test_points], dtype=np.float64).reshape((-1, 2))
+    differences = ref_coms[:, None, :] - test_coms[None, :, :]
+
+    return np.sqrt(np.sum(differences ** 2, axis=2))
+
+
+def move_coms(c_ref: np.ndarray, c_test: np.ndarray, move_vector: Optional[np.ndarray] = None) -> np.ndarray:
     """
     Moves the test contour to align the center of mass with the COM of the reference contour.
 
     Args:
         c_ref: the reference contour points (coordinates)
         c_test: the test contour points (coordinates)
+        move_vector: if given, the test contour is moved by this vector instead of the COM difference
+            (e.g. the COM difference of the full contours, before resampling)
 
     Returns:
         c_test_corrected: the moved test contour.
     """
+    if move_vector is None:
+        move_vector = find_move_vector(c_ref=c_ref, c_test=c_test)
+    c_test_corrected = np.add(c_test, move_vector.reshape((-1, 1)))
 
+    return c_test_corrected
+
+
+def find_move_vector(c_ref: np.ndarray, c_test: np.ndarray) -> np.ndarray:
+    """
+    The difference of the COMs of the reference and the test contour (the vector aligning the test contour).
+    """
     com_ref = c_ref.mean(axis=1)
     com_test = c_test.mean(axis=1)
-    move_vector = (com_ref - com_test).reshape((2, 1))
-    c_test_corrected = np.add(c_test, move_vector)
 
-    return c_test_corrected
+    return com_ref - com_test
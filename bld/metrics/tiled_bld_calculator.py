@@ -0,0 +1,142 @@
+from typing import Optional
+
+import numpy as np
+
+from bld.metrics import BLDCalculator
+from bld.metrics.distance_calculator import find_paired_distances
+
+
+class TiledBLDCalculator(BLDCalculator):
+    """
+    Calculates the BLD from the table of pairwise distances, computed in blocks of reference points (rows),
+    so that the memory usage stays under a budget even for very long contours.
+
+    The row minima (FMinD), the column minima and their first indices are reduced block by block,
+    then the BMaxD and the BLD are calculated as in BLDCalculator. Where the BMaxD is larger than the FMinD,
+    the rows are computed once more to find the BLD pairs. The distances of the blocks are the same
+    bit by bit as the ones of the full table, so the results are identical to the ones of BLDCalculator.
+
+    Args:
+        reference_points: the reference point's numpy array
+        test_corrected_points: the test point's numpy array after aligning the COMs
+        test_points: the test point's numpy array
+        memory_budget: the approximate memory of the temporary arrays of one block in bytes
+        move_vector: the vector which aligned the test contour (None: the difference of the COMs)
+
+    Returns:
+        visualization_data: contains bmaxd_indices, fmind and bmaxd, which are necessary for visualization
+        dist_bld: BLD values calculated after aligning the reference and test COMs
+        dist_bld_signed: signed BLD values (inside or outside location)
+        final_bld: numpy array of the BLD values calculated after moving back the test contour
+        location: 1 if the test point is inside, 0 if on the reference contour, -1 if outside
+        row_bld_indices: the index of the test point paired to each reference point based on BLD
+        paired_test_points_moved_back: numpy array containing the test points
+            which are pairs of reference contour points based on BLD
+        block_size: the number of reference points (rows) in one block
+    """
+
+    # the temporary arrays of one row of a block: the scalar products, the sums,
+    # the distances (float64) and the comparisons with the minima
+    bytes_per_distance = 4 * 8
+
+    def __init__(self, reference_points: np.ndarray,
+                 test_corrected_points: np.ndarray,
+                 test_points: np.ndarray,
+                 memory_budget: Optional[int] = 2 ** 26,
+                 move_vector: Optional[np.ndarray] = None):
+        self.dist_calc = None
+        self.distance_matrix = None
+        self.reference_points = reference_points
+        self.test_corrected_points = test_corrected_points
+        self.test_points = test_points
+        self.memory_budget = memory_budget
+        self.move_vector = move_vector
+
+        self.c_ref = self.reference_points.T
+        self.c_test = self.test_corrected_points.T
+        self.block_size = max(1, int(memory_budget // (TiledBLDCalculator.bytes_per_distance
+                                                       * max(self.c_test.shape[0], 1))))
+
+        self.visualization_data: dict = dict()
+        self.dist_bld: list = []
+        self.dist_bld_signed: list = []
+        self.final_bld: list = []
+        self.location: list = []
+        self.row_min: np.ndarray = np.array([])
+        self.row_min_indices: np.ndarray = np.array([], dtype=np.int_)
+        self.row_bld_indices: np.ndarray = np.array([], dtype=np.int_)
+        self.paired_test_points_moved_back: np.ndarray = np.array([], dtype=np.int_)
+
+    def find_block(self, ref_indices: np.ndarray) -> np.ndarray:
+        """
+        Finds the distances of the selected reference points (rows) to all the test points.
+        """
+        return find_paired_distances(c_ref=self.c_ref[ref_indices][:, np.newaxis, :],
+                                     c_test=self.c_test[np.newaxis, :, :])
+
+    def calculate_bld(self):
+        """
+        Calculates the BLD to each reference point.
+        """
+        number_of_ref_points = self.c_ref.shape[0]
+        number_of_test_points = self.c_test.shape[0]
+
+        row_min = np.zeros((number_of_ref_points,))
+        row_min_indices = np.zeros((number_of_ref_points,), dtype=np.int_)
+        column_min = np.full((number_of_test_points,), np.inf)
+        column_min_indices = np.zeros((number_of_test_points,), dtype=np.int_)
+        for start in range(0, number_of_ref_points, self.block_size):
+            rows = np.arange(start, min(start + self.block_size, number_of_ref_points))
+            block = self.find_block(ref_indices=rows)
+
+            row_min[rows] = block.min(axis=1)
+            row_min_indices[rows] = np.argmin(block, axis=1)
+
+            # the earlier blocks keep the column minimum in case of equal distances (the first index)
+            block_column_min = block.min(axis=0)
+            is_smaller = block_column_min < column_min
+            column_min[is_smaller] = block_column_min[is_smaller]
+            column_min_indices[is_smaller] = start + np.argmin(block, axis=0)[is_smaller]
+
+        # the reference points (rows) to which there exist column minimum
+        filter_row_index_where_exists_column_min = np.zeros((number_of_ref_points,), dtype=bool)
+        filter_row_index_where_exists_column_min[column_min_indices] = True
+        bmaxd_indices = np.arange(
+            0, number_of_ref_points, 1
+        )[filter_row_index_where_exists_column_min]
+
+        # the BMaxD is the maximum of the column minimums
+        bmaxd_all = np.zeros((number_of_ref_points,))
+        np.maximum.at(bmaxd_all, column_min_indices, column_min)
+        bmaxd = bmaxd_all[bmaxd_indices]
+
+        fmind = row_min[bmaxd_indices]
+
+        # BLD is the maximum of BMaxD and FMinD, if BMaxD does not exist, then BLD = FMinD
+        bld = row_min.copy()
+        bld[bmaxd_indices] = np.maximum(bmaxd, fmind)
+
+        self.visualization_data = {
+            "bmaxd_indices": bmaxd_indices,
+            "fmind": fmind,
+            "bmaxd": bmaxd
+        }
+        self.dist_bld = bld
+        self.row_min = row_min
+        self.row_min_indices = row_min_indices
+        self.row_bld_indices = self.find_bld_pairs()
+
+    def find_bld_pairs(self) -> np.ndarray:
+        """
+        Finds the first test point for each reference point, whose distance equals to the BLD.
+        Where the BLD is the FMinD, the pair is the first row minimum, which is already known,
+        the rows are only computed again for the reference points where the BMaxD is larger.
+        """
+        row_bld_indices = self.row_min_indices.copy()
+        bmaxd_rows = np.flatnonzero(self.dist_bld > self.row_min)
+        for start in range(0, bmaxd_rows.shape[0], self.block_size):
+            rows = bmaxd_rows[start:start + self.block_size]
+            block = self.find_block(ref_indices=rows)
+            row_bld_indices[rows] = np.argmax(block == self.dist_bld[rows].reshape((-1, 1)), axis=1)
+
+        return row_bld_indices
@@ -0,0 +1,152 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from scipy import ndimage
+
+from bld.metrics.kdtree_bld_calculator import KDTreeBLDCalculator
+from bld.metrics.msi_calculator import MSICalculator, find_com, move_coms
+
+
+class VolumetricMSICalculator:
+    """
+    Calculates the MSI of a whole volume in 3D, instead of slice by slice.
+
+    The surface voxels of the reference and the test masks are converted to point clouds
+    in physical coordinates (using the spacing of the image), then the BLD is calculated
+    between the two surfaces with k-d tree queries (VolumetricBLDCalculator).
+    All the foreground voxels of a mask form one surface, the components are not paired.
+
+    Args:
+        il: inside penalty level
+        ol: outside penalty level
+        mask_ref: the 3D reference mask (numpy array)
+        mask_test: the 3D test mask (numpy array with the same shape)
+        spacing: the size of the voxels in the order of the array axes
+            (the reverse of the SimpleITK spacing, which is in x, y, z order)
+
+    Returns:
+        ref_points: the reference surface points, shape (3, number of points)
+        test_points: the test surface points, shape (3, number of points)
+        final_bld: the final BLD values of the reference surface points
+        msi: the calculated MSI value
+    """
+
+    def __init__(self, il: float, ol: float, mask_ref: np.ndarray, mask_test: np.ndarray,
+                 spacing: Optional[Tuple[float, float, float]] = (1.0, 1.0, 1.0)):
+        if mask_ref.shape != mask_test.shape:
+            raise ValueError("The shapes of the masks differ: %s and %s" % (mask_ref.shape, mask_test.shape))
+
+        self.il = il
+        self.ol = ol
+        self.mask_ref = mask_ref != 0
+        self.mask_test = mask_test != 0
+        self.spacing = np.asarray(spacing, dtype=np.float64)
+
+        self.ref_points = find_surface_points(mask=self.mask_ref, spacing=self.spacing)
+        self.test_points = find_surface_points(mask=self.mask_test, spacing=self.spacing)
+
+        self.final_bld: np.ndarray = np.array([])
+        self.msi: float = 0
+
+    def run(self):
+        self.run_bld()
+        self.msi = float(MSICalculator.calculate_msi_batch(final_blds=[self.final_bld], il=self.il, ol=self.ol)[0])
+
+    def run_bld(self):
+        """
+        Calculate the final BLD values of the reference surface points (only once).
+        """
+        if self.ref_points.shape[1] == 0 or self.test_points.shape[1] == 0:
+            raise ValueError("The reference and the test masks must not be empty")
+
+        if len(self.final_bld) == 0:
+            bld_calc = VolumetricBLDCalculator(
+                reference_points=self.ref_points,
+                test_corrected_points=move_coms(c_ref=self.ref_points, c_test=self.test_points),
+                test_points=self.test_points,
+                mask_test=self.mask_test,
+                spacing=self.spacing)
+            bld_calc.run()
+            self.final_bld = bld_calc.final_bld
+
+    def sweep(self, il_values: list, ol_values: list) -> np.ndarray:
+        """
+        Calculate the MSI for all the combinations of the penalty levels.
+
+        Returns:
+            msi: numpy array of shape (number of il values, number of ol values)
+        """
+        self.run_bld()
+
+        msi_grid = MSICalculator.calculate_msi_grid(final_blds=[self.final_bld],
+                                                    il_values=il_values, ol_values=ol_values)
+
+        return msi_grid[0]
+
+
+class VolumetricBLDCalculator(KDTreeBLDCalculator):
+    """
+    Calculates the BLD between two 3D surface point clouds.
+
+    The BLD is calculated by the k-d tree engine. The location of a reference point is found
+    in the test mask moved by the COM correction (instead of the point polygon test of the 2D contours).
+
+    Args:
+        reference_points: the reference surface points, shape (3, number of points)
+        test_corrected_points: the test surface points after aligning the COMs
+        test_points: the test surface points
+        mask_test: the 3D test mask
+        spacing: the size of the voxels in the order of the array axes
+
+    Returns:
+        the same as KDTreeBLDCalculator
+    """
+
+    def __init__(self, reference_points: np.ndarray,
+                 test_corrected_points: np.ndarray,
+                 test_points: np.ndarray,
+                 mask_test: np.ndarray,
+                 spacing: np.ndarray):
+        super().__init__(reference_points=reference_points,
+                         test_corrected_points=test_corrected_points,
+                         test_points=test_points)
+        self.mask_test = mask_test
+        self.spacing = np.asarray(spacing, dtype=np.float64)
+
+    def calculate_signed_distances(self):
+        """
+        Finds if a reference point is inside or outside the moved test volume and gives signed BLD.
+        The reference points on the moved test surface (FMinD = 0) are on the contour.
+        """
+        move_vector = find_com(self.test_corrected_points) - find_com(self.test_points)
+
+        # the voxel of the original test mask, which is moved to the reference point
+        indices = np.rint((self.c_ref - move_vector) / self.spacing).astype(np.int_)
+        is_in_volume = np.all((indices >= 0) & (indices < np.array(self.mask_test.shape)), axis=1)
+
+        # 1: inside, 0: on the surface, -1: outside
+        loc = np.full((self.c_ref.shape[0],), -1.0)
+        is_inside = np.zeros((self.c_ref.shape[0],), dtype=bool)
+        is_inside[is_in_volume] = self.mask_test[tuple(indices[is_in_volume].T)]
+        loc[is_inside] = 1.0
+        loc[self.row_min == 0] = 0.0
+
+        self.dist_bld_signed = np.multiply(loc, self.dist_bld)
+        self.location = loc
+
+
+def find_surface_points(mask: np.ndarray, spacing: np.ndarray) -> np.ndarray:
+    """
+    Finds the surface voxels of a mask (the foreground voxels with a background face neighbour).
+
+    Args:
+        mask: the 3D boolean mask
+        spacing: the size of the voxels in the order of the array axes
+
+    Returns:
+        points: the physical coordinates of the surface voxels, shape (3, number of points)
+    """
+    structure = ndimage.generate_binary_structure(rank=mask.ndim, connectivity=1)
+    surface = mask & ~ndimage.binary_erosion(mask, structure=structure, border_value=0)
+
+    return (np.argwhere(surface) * np.asarray(spacing, dtype=np.float64)).T
@@ -1,2 +1,3 @@
 from .formatter import Formatter
 from .split_mask import MaskSplitter
+from .profiling import Profiler
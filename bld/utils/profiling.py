@@ -0,0 +1,223 @@
+import json
+import threading
+import time
+from typing import Callable, Optional
+
+import pandas as pd
+
+
+class Profiler:
+    """
+    Records the wall time, the number of calls and the array sizes of the stages of the pipeline.
+
+    The classes of the pipeline (DataLoader, MSICalculator, MetricsEvaluator, CohortEvaluator) take
+    an optional profiler and wrap their stages in profiler.stage(name, size=...). A disabled profiler
+    (the default) returns the same empty context manager for every stage, so it costs one method call.
+    The totals are kept for each stage and for each (slice, stage) pair, the individual calls are
+    kept as events if trace is True (they can be exported to the Chrome trace format).
+
+    The slices (and the patients) are recorded by child profilers, which are merged in the order
+    of the slices, so the same profiler works with thread and process pools.
+
+    Args:
+        enabled: if False, nothing is recorded
+        trace: if True, every call of a stage is stored in events
+        callback: called with each event (stage, slice, start, duration, size) as it is recorded
+            (the events of the child profilers are passed when they are merged)
+        slice_index: the slice of the recorded calls (None: the calls do not belong to a slice)
+
+    Returns:
+        stages: the totals of each stage (name: [calls, total time, maximal time, total size])
+        slice_stages: the totals of each stage of each slice ((slice index, name): [calls, total time, total size])
+        events: the recorded calls, if trace is True
+    """
+
+    def __init__(self, enabled: Optional[bool] = True, trace: Optional[bool] = False,
+                 callback: Optional[Callable[[dict], None]] = None,
+                 slice_index: Optional[int] = None):
+        self.enabled = enabled
+        self.trace = trace
+        self.callback = callback
+        self.slice_index = slice_index
+
+        self.stages: dict = dict()
+        self.slice_stages: dict = dict()
+        self.events: list = []
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+
+    def __getstate__(self) -> dict:
+        # the callback stays in the process which created the profiler
+        state = self.__dict__.copy()
+        state['callback'] = None
+        del state['lock']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def stage(self, name: str, size: Optional[int] = None, slice_index: Optional[int] = None):
+        """
+        The context manager which times one call of a stage.
+
+        Args:
+            name: the name of the stage
+            size: the size of the processed data (e.g. the number of points or distances)
+            slice_index: the slice of the call (None: the slice of the profiler)
+        """
+        if not self.enabled:
+            return disabled_stage
+
+        return ProfiledStage(profiler=self, name=name, size=size, slice_index=slice_index)
+
+    def record(self, name: str, start: float, duration: float,
+               size: Optional[int] = None, slice_index: Optional[int] = None):
+        """
+        Records one call of a stage (start is a time.perf_counter value).
+        """
+        if slice_index is None:
+            slice_index = self.slice_index
+        event = {"stage": name, "slice": slice_index, "start": start, "duration": duration, "size": size}
+
+        with self.lock:
+            self.add(event=event)
+        if self.callback is not None:
+            self.callback(event)
+
+    def add(self, event: dict):
+        """
+        Adds an event to the totals (the caller holds the lock).
+        """
+        size = 0 if event["size"] is None else int(event["size"])
+        totals = self.stages.setdefault(event["stage"], [0, 0.0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += event["duration"]
+        totals[2] = max(totals[2], event["duration"])
+        totals[3] += size
+        if event["slice"] is not None:
+            slice_totals = self.slice_stages.setdefault((event["slice"], event["stage"]), [0, 0.0, 0])
+            slice_totals[0] += 1
+            slice_totals[1] += event["duration"]
+            slice_totals[2] += size
+        if self.trace:
+            self.events.append(event)
+
+    def child(self, slice_index: Optional[int] = None) -> 'Profiler':
+        """
+        Creates an empty profiler with the same settings (e.g. for one slice), it is merged back by merge.
+        """
+        return Profiler(enabled=self.enabled, trace=self.trace or self.callback is not None,
+                        slice_index=slice_index)
+
+    def merge(self, other: 'Profiler'):
+        """
+        Adds the records of another profiler (e.g. of a slice evaluated by a worker).
+        """
+        if not self.enabled or other is None:
+            return
+
+        with self.lock:
+            for name, (calls, total_time, max_time, size) in other.stages.items():
+                totals = self.stages.setdefault(name, [0, 0.0, 0.0, 0])
+                totals[0] += calls
+                totals[1] += total_time
+                totals[2] = max(totals[2], max_time)
+                totals[3] += size
+            for key, (calls, total_time, size) in other.slice_stages.items():
+                slice_totals = self.slice_stages.setdefault(key, [0, 0.0, 0])
+                slice_totals[0] += calls
+                slice_totals[1] += total_time
+                slice_totals[2] += size
+            if self.trace:
+                self.events.extend(other.events)
+        if self.callback is not None:
+            for event in other.events:
+                self.callback(event)
+
+    def summary(self, by_slice: Optional[bool] = False) -> pd.DataFrame:
+        """
+        The table of the recorded stages, sorted by the total time.
+
+        Args:
+            by_slice: if True, one row for each stage of each slice (the stages outside the slices are left out)
+
+        Returns:
+            summary: the number of calls, the total, mean and maximal time (seconds) and the total size
+                of each stage (the time of a stage includes the time of the stages called by it)
+        """
+        if by_slice:
+            rows = [{"slice": slice_index, "stage": name, "calls": calls, "total_time": total_time,
+                     "mean_time": total_time / calls, "total_size": size}
+                    for (slice_index, name), (calls, total_time, size) in self.slice_stages.items()]
+            return pd.DataFrame(rows, columns=["slice", "stage", "calls", "total_time", "mean_time", "total_size"]
+                                ).sort_values(by=["slice", "total_time"], ascending=[True, False], ignore_index=True)
+
+        rows = [{"stage": name, "calls": calls, "total_time": total_time, "mean_time": total_time / calls,
+                 "max_time": max_time, "total_size": size}
+                for name, (calls, total_time, max_time, size) in self.stages.items()]
+        table = pd.DataFrame(rows, columns=["stage", "calls", "total_time", "mean_time", "max_time", "total_size"])
+
+        return table.sort_values(by="total_time", ascending=False, ignore_index=True)
+
+    def export_trace(self, file_path: str):
+        """
+        Saves the events in the Chrome trace format (chrome://tracing, Perfetto), one row for each slice.
+        """
+        trace_events = [{
+            "name": event["stage"], "ph": "X", "pid": 0,
+            "tid": -1 if event["slice"] is None else event["slice"],
+            "ts": (event["start"] - self.start_time) * 1e6, "dur": event["duration"] * 1e6,
+            "args": {"size": event["size"]}
+        } for event in self.events]
+        with open(file_path, 'w') as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+
+class ProfiledStage:
+    """
+    Times one call of a stage and records it in the profiler.
+    """
+
+    __slots__ = ("profiler", "name", "size", "slice_index", "start")
+
+    def __init__(self, profiler: Profiler, name: str, size: Optional[int], slice_index: Optional[int]):
+        self.profiler = profiler
+        self.name = name
+        self.size = size
+        self.slice_index = slice_index
+        self.start = 0.0
+
+    def __enter__(self) -> 'ProfiledStage':
+        self.start = time.perf_counter()
+        return self
+
+    def set_size(self, size: int):
+        """
+        Sets the size of the processed data, if it is only known inside the stage.
+        """
+        self.size = size
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(name=self.name, start=self.start, duration=time.perf_counter() - self.start,
+                             size=self.size, slice_index=self.slice_index)
+
+
+class DisabledStage:
+    """
+    The context manager of a disabled profiler, it does nothing.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> 'DisabledStage':
+        return self
+
+    def set_size(self, size: int):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+disabled_stage = DisabledStage()
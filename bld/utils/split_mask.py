@@ -29,7 +29,14 @@ class MaskSplitter:
         # cv.findContours(
         #     image, mode, method[, contours[, hierarchy[, offset]]]
         # ) ->	image, contours, hierarchy
-        contours, hierarchy = cv.findContours(self.thresh, 2, 1)
+        # the contours are found in the bounding box of the foreground (with a margin of one pixel),
+        # the offset shifts them back to the coordinates of the slice
+        x, y, width, height = cv.boundingRect(self.thresh)
+        if width == 0 or height == 0:
+            return
+        x_start, y_start = max(x - 1, 0), max(y - 1, 0)
+        contours, hierarchy = cv.findContours(self.thresh[y_start:y + height + 1, x_start:x + width + 1], 2, 1,
+                                              offset=(x_start, y_start))
 
         for contour in contours:
             self.run_for_one_contour(contour=contour)
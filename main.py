@@ -2,9 +2,6 @@ from bld.data import DataDownloader, DataLoader
 from bld.metrics import MSICalculator
 from bld.evaluation import MetricsEvaluator
 
-import pandas as pd
-import statistics
-
 
 def main():
     folder_url_ref = 'https://drive.google.com/uc?export=download&id=1u2CMExEtQSi1iMclEdlr84YkgY-fd2C-'
@@ -22,7 +19,8 @@ def main():
     ol_const = 1  # outside level
 
     # load the data corresponding the selected patient
-    dl = DataLoader(patient=number, data_downloader=ddl)
+    # (lazy: only the contours of the selected slice are extracted)
+    dl = DataLoader(patient=number, data_downloader=ddl, lazy=True)
 
     # get the contours from the images
     points_ref = dl.c_ref[im_slice]
@@ -38,31 +36,11 @@ def main():
 
 
     # evaluate all the slices for one patient
-    evaluator = MetricsEvaluator(patient=number, datadownloader=ddl, il=il_const, ol=ol_const)
+    evaluator = MetricsEvaluator(patient=number, data_downloader=ddl, il=il_const, ol=ol_const)
     evaluator.evaluate()
 
-    m = []
-    for i in range(len(evaluator.msindex)):
-        msi_median = statistics.median(evaluator.msindex[i])
-        m.append(float(msi_median))
-
-    d = []
-    for i in range(len(evaluator.dice)):
-        d.append(float(evaluator.dice[i]))
-
-    j = []
-    for i in range(len(evaluator.jacc)):
-        j.append(float(evaluator.jacc[i]))
-
-    h = []
-    for i in range(len(evaluator.haus)):
-        h.append(float(evaluator.haus[i]))
-
-    idx = []
-    for i in range(len(evaluator.idx)):
-        idx.append(int(evaluator.idx[i]))
-
-    data = pd.DataFrame({'MSI': m, 'Dice': d, 'Jaccard': j, 'Hausdorff': h, 'index': idx})
+    # one row for each slice: the median MSI of the contours, Dice, Jaccard, Hausdorff and the slice index
+    data = evaluator.results.find_slice_medians()
 
 
 if __name__ == '__main__':